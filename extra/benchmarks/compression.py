@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import absolute_import, print_function
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+# Measures the bandwidth saved and the CPU spent by SSH zlib compression on a printer log stream.
+# Every write is compressed and sync flushed on its own, exactly like the SSH transport does per packet.
+#
+#   python extra/benchmarks/compression.py --file ~/.octoprint/logs/serial.log --output compression.json
+
+import argparse
+import json
+import random
+import sys
+import time
+import zlib
+
+LEVELS = [1, 3, 6, 9]
+
+# Framing written by the terminal command for every printer log line.
+TERMINAL_PREFIX = b'\x1b[2K\r\n\x1b[A'
+TERMINAL_SUFFIX = b'\r\n> '
+
+
+def generate_log(lines, seed=0):
+    rnd = random.Random(seed)
+    result = []
+    n = 0
+    for i in range(lines):
+        r = rnd.random()
+        if r < 0.35:
+            result.append('Recv:  T:{:.2f} /210.00 B:{:.2f} /60.00 @:{} B@:{}'.format(rnd.gauss(210, 0.4), rnd.gauss(60, 0.2), rnd.randint(0, 127), rnd.randint(0, 127)))
+        elif r < 0.7:
+            n += 1
+            result.append('Send: N{} G1 X{:.3f} Y{:.3f} E{:.5f}*{}'.format(n, rnd.uniform(0, 220), rnd.uniform(0, 220), rnd.uniform(0, 2), rnd.randint(0, 255)))
+        elif r < 0.98:
+            result.append('Recv: ok')
+        else:
+            result.append('Recv: echo:busy: processing')
+    return result
+
+
+def read_log(path):
+    with open(path, 'rb') as f:
+        lines = [l.rstrip(b'\r\n') for l in f]
+    # serial.log lines start with a timestamp and the logger name.
+    return [l.split(b' - ', 1)[-1].decode('utf-8', 'replace') for l in lines if l]
+
+
+def packets(lines, mode, batch):
+    if mode == 'terminal':
+        for line in lines:
+            yield TERMINAL_PREFIX
+            yield line.encode('utf-8')
+            yield TERMINAL_SUFFIX
+    else:
+        for i in range(0, len(lines), batch):
+            yield ('\n'.join(lines[i:i + batch]) + '\n').encode('utf-8')
+
+
+def bench(data, level):
+    raw = 0
+    compressed = 0
+    start = time.process_time()
+    if level:
+        c = zlib.compressobj(level)
+        for packet in data:
+            raw += len(packet)
+            compressed += len(c.compress(packet) + c.flush(zlib.Z_SYNC_FLUSH))
+    else:
+        for packet in data:
+            raw += len(packet)
+        compressed = raw
+    return raw, compressed, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--file', help="replay a recorded serial.log instead of a synthetic stream")
+    parser.add_argument('--lines', type=int, default=200000, help="number of synthetic log lines")
+    parser.add_argument('--mode', choices=('terminal', 'stream'), default='terminal', help="framing of the `terminal` command or the serial-stream exec command")
+    parser.add_argument('--batch', type=int, default=20, help="lines per write in stream mode")
+    parser.add_argument('--output', help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    lines = read_log(args.file) if args.file else generate_log(args.lines)
+    data = list(packets(lines, args.mode, args.batch))
+
+    results = dict(lines=len(lines), packets=len(data), mode=args.mode, python=sys.version.split()[0], zlib=zlib.ZLIB_RUNTIME_VERSION, levels=[])
+    for level in [0] + LEVELS:
+        raw, compressed, cpu = bench(data, level)
+        results['levels'].append(dict(level=level,
+                                      raw_bytes=raw,
+                                      wire_bytes=compressed,
+                                      ratio=round(float(compressed) / raw, 3),
+                                      cpu_seconds=round(cpu, 4),
+                                      us_per_packet=round(cpu * 1e6 / len(data), 2),
+                                      mb_per_cpu_second=round(raw / 1048576.0 / cpu, 1) if cpu else None))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# coding=utf-8
+from __future__ import absolute_import, print_function
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+# Benchmarks the chunked grep scanner against a naive line by line search on synthetic G-code.
+#
+#   python extra/benchmarks/grep_gcode.py --size 300 --output grep.json
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'octoprint_sshinterface'))
+import opsshgrep
+
+PATTERNS = ['M104', 'Error', r'^G1 X1\d\d\.', 'layer 5[0-9]{2}']
+
+
+def generate_gcode(path, size_mb, seed=0):
+    rnd = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    layer = 0
+    with open(path, 'wb') as f:
+        f.write(b'; generated by grep_gcode.py\nM104 S210\nM140 S60\nG28\n')
+        while written < target:
+            lines = [';LAYER:{}\n; layer {}\nG1 Z{:.2f} F600\n'.format(layer, layer, 0.2 * (layer + 1))]
+            for _ in range(2000):
+                lines.append('G1 X{:.3f} Y{:.3f} E{:.5f} F{}\n'.format(rnd.uniform(0, 220), rnd.uniform(0, 220), rnd.uniform(0, 2), rnd.choice((1200, 1800, 3000))))
+            data = ''.join(lines).encode('ascii')
+            f.write(data)
+            written += len(data)
+            layer += 1
+    return os.path.getsize(path)
+
+
+def bench_chunked(path, pattern, chunk_size):
+    regex = opsshgrep.compile_pattern(pattern)
+    matches = 0
+    longest = 0.0
+    start = time.time()
+    with open(path, 'rb') as f:
+        it = opsshgrep.grep_file(f, regex, line_numbers=True, chunk_size=chunk_size)
+        while True:
+            t = time.time()
+            try:
+                chunk = next(it)
+            except StopIteration:
+                break
+            longest = max(longest, time.time() - t)
+            matches += len(chunk)
+    return matches, time.time() - start, longest
+
+
+def bench_naive(path, pattern):
+    regex = re.compile(pattern.encode('utf-8'))
+    matches = 0
+    start = time.time()
+    with open(path, 'rb') as f:
+        for line in f:
+            if regex.search(line):
+                matches += 1
+    return matches, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=100, help="size of the synthetic G-code file in MiB")
+    parser.add_argument('--file', help="use an existing G-code file instead of generating one")
+    parser.add_argument('--chunk-size', type=int, default=opsshgrep.CHUNK_SIZE)
+    parser.add_argument('--output', help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.file:
+        path = args.file
+        size = os.path.getsize(path)
+    else:
+        tmp = tempfile.NamedTemporaryFile(suffix='.gcode', delete=False)
+        tmp.close()
+        path = tmp.name
+        size = generate_gcode(path, args.size)
+
+    results = dict(file_bytes=size, chunk_size=args.chunk_size, python=sys.version.split()[0], patterns=[])
+    try:
+        for pattern in PATTERNS:
+            matches, elapsed, longest = bench_chunked(path, pattern, args.chunk_size)
+            naive_matches, naive_elapsed = bench_naive(path, pattern)
+            results['patterns'].append(dict(pattern=pattern,
+                                            matches=matches,
+                                            seconds=round(elapsed, 4),
+                                            mb_per_second=round(size / 1048576.0 / elapsed, 1),
+                                            longest_chunk_ms=round(longest * 1000, 2),
+                                            naive_matches=naive_matches,
+                                            naive_seconds=round(naive_elapsed, 4)))
+    finally:
+        if tmp:
+            os.unlink(path)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+# coding=utf-8
+from __future__ import absolute_import, print_function
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+# End to end load test. Runs SSHInterface on loopback against a stand-in printer that emits log
+# lines at a fixed rate, then connects many scripted conch clients from a second process.
+# Every client authenticates, runs ls, cat and status and then stays in terminal mode while
+# log delivery latency is measured. Requires an environment with OctoPrint installed.
+#
+#   python extra/benchmarks/load.py --clients 200 --rate 50 --duration 30 --output load.json
+
+import argparse
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+USERNAME = 'bench'
+PASSWORD = 'bench'
+COMMANDS = ['ls /uploads', 'cat /uploads/bench.gcode', 'status']
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return None
+    values = sorted(values)
+    result = dict(("p{}".format(p), round(values[min(len(values) - 1, int(len(values) * p / 100.0))] * 1000, 3)) for p in points)
+    result['max'] = round(values[-1] * 1000, 3)
+    result['samples'] = len(values)
+    return result
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+# Server side
+
+class BenchSettings(object):
+    def __init__(self, defaults, basedir, overrides):
+        self.values = dict(defaults)
+        self.values.update(overrides)
+        self.basedir = basedir
+
+    def get(self, path, **kwargs):
+        return self.values.get(path[0])
+
+    def get_int(self, path, **kwargs):
+        return int(self.values.get(path[0]) or 0)
+
+    def get_boolean(self, path, **kwargs):
+        return bool(self.values.get(path[0]))
+
+    def global_get_basefolder(self, name):
+        path = os.path.join(self.basedir, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+
+class BenchUser(object):
+    is_active = True
+
+    def __init__(self, name):
+        from octoprint.access.permissions import Permissions
+        self.name = name
+        self.effective_permissions = set(Permissions.all())
+
+
+class BenchUserManager(object):
+    def check_password(self, username, password):
+        return username == USERNAME and password == PASSWORD
+
+    def find_user(self, userid=None, **kwargs):
+        return BenchUser(userid)
+
+    def get_user_setting(self, username, key):
+        return []
+
+    def register_login_status_listener(self, listener):
+        pass
+
+    def unregister_login_status_listener(self, listener):
+        pass
+
+
+class BenchGroupManager(object):
+    def register_listener(self, listener):
+        pass
+
+    def unregister_listener(self, listener):
+        pass
+
+
+class BenchFileManager(object):
+    def get_metadata(self, destination, path):
+        return None
+
+
+class BenchPrinter(object):
+    def __init__(self, rate):
+        self.rate = rate
+        self.emitted = 0
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def unregister_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        due = time.time()
+        while not self._stop.is_set():
+            now = time.time()
+            if now < due:
+                self._stop.wait(due - now)
+                continue
+            if now - due > 1:
+                due = now
+
+            line = "Recv:  T:210.00 /210.00 B:60.00 /60.00 @:64 B@:0 seq={} ts={:.6f}".format(self.emitted, time.time())
+            for callback in list(self._callbacks):
+                callback.on_printer_add_log(line)
+            self.emitted += 1
+            due += interval
+
+    def get_current_data(self):
+        return dict(state=dict(text="Printing", flags=dict(printing=True, paused=False, operational=True, error=False)),
+                    job=dict(file=dict(name="bench.gcode", path="bench.gcode", size=1048576), estimatedPrintTime=3600),
+                    progress=dict(completion=42.0, filepos=440401, printTime=1512, printTimeLeft=2088),
+                    currentZ=12.4)
+
+    def get_current_temperatures(self):
+        return dict(tool0=dict(actual=210.0, target=210.0), bed=dict(actual=60.0, target=60.0))
+
+    def commands(self, commands, **kwargs):
+        pass
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_server(basedir, port, rate):
+    sys.path.insert(0, ROOT)
+    import octoprint_sshinterface
+
+    plugin = octoprint_sshinterface.SSHInterface()
+    plugin._identifier = 'sshinterface'
+    plugin._plugin_version = 'bench'
+    plugin._logger = logging.getLogger("octoprint.plugins.sshinterface")
+    plugin._settings = BenchSettings(plugin.get_settings_defaults(), basedir, dict(
+        port=port,
+        bind_address='127.0.0.1',
+        max_connections=0,
+        max_connections_per_user=0,
+        max_unauthenticated=0,
+        keepalive_interval=0))
+    plugin._printer = BenchPrinter(rate)
+    plugin._user_manager = BenchUserManager()
+    plugin._group_manager = BenchGroupManager()
+    plugin._file_manager = BenchFileManager()
+
+    with open(os.path.join(plugin._settings.global_get_basefolder('uploads'), 'bench.gcode'), 'w') as f:
+        for i in range(2000):
+            f.write("G1 X{:.3f} Y{:.3f} E{:.5f}\n".format(i % 220, (i * 7) % 220, i * 0.01))
+
+    plugin.on_settings_initialized()
+    return plugin
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except (IOError, OSError):
+            time.sleep(0.1)
+    return False
+
+
+def run_server(args):
+    basedir = tempfile.mkdtemp(prefix='sshinterface-bench-')
+    port = free_port()
+    result = dict(clients=args.clients, rate=args.rate, duration=args.duration, python=sys.version.split()[0])
+    try:
+        rss_start = rss_kb()
+        plugin = start_server(basedir, port, args.rate)
+        if not wait_for_port(port):
+            raise RuntimeError("server did not start listening on port {}".format(port))
+        result['reactor'] = plugin.loop.name
+        result['server_rss_idle_kb'] = rss_kb()
+
+        plugin._printer.start()
+        cpu_start = time.process_time()
+        clients = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--role', 'client', '--port', str(port),
+                                    '--clients', str(args.clients), '--connect-rate', str(args.connect_rate),
+                                    '--duration', str(args.duration)], stdout=subprocess.PIPE)
+
+        peak = 0
+        while clients.poll() is None:
+            peak = max(peak, rss_kb() or 0)
+            time.sleep(0.5)
+        output = clients.stdout.read()
+        plugin._printer.stop()
+
+        result['server_cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+        result['server_rss_start_kb'] = rss_start
+        result['server_rss_peak_kb'] = peak or None
+        result['server_maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['lines_emitted'] = plugin._printer.emitted
+        result.update(json.loads(output.decode('utf-8')))
+
+        plugin.on_shutdown()
+    finally:
+        shutil.rmtree(basedir, ignore_errors=True)
+
+    return result
+
+
+# Client side
+
+def run_clients(args):
+    from twisted.conch.ssh import channel, connection, session, transport, userauth
+    from twisted.internet import defer, protocol, reactor
+
+    ts = re.compile(br'ts=(\d+\.\d+)')
+    stats = dict(connect=[], handshake=[], commands=dict((c.split()[0], []) for c in COMMANDS), latency=[],
+                 terminal_bytes=0, terminal_lines=0, failed=0, completed=0, first_connect=None, last_handshake=None)
+
+    class BenchChannel(channel.SSHChannel):
+        name = b'session'
+
+        def channelOpen(self, data):
+            self.buf = b''
+            self.pending = list(COMMANDS)
+            self.command = None
+            self.sent = None
+            self.in_terminal = False
+            self.conn.sendRequest(self, b'pty-req', session.packRequest_pty_req(b'xterm', (24, 80, 0, 0), b''))
+            self.conn.sendRequest(self, b'shell', b'')
+
+        def dataReceived(self, data):
+            if self.in_terminal:
+                self._terminal(data)
+                return
+
+            self.buf += data
+            if b']$ ' not in self.buf:
+                return
+
+            if self.command:
+                stats['commands'][self.command].append(time.time() - self.sent)
+            self.buf = b''
+            if self.pending:
+                line = self.pending.pop(0)
+                self.command = line.split()[0]
+            else:
+                line = 'terminal'
+                self.command = None
+                self.in_terminal = True
+                self.entered = None
+                reactor.callLater(args.duration, self.done)
+            self.sent = time.time()
+            self.write(line.encode('utf-8') + b'\r')
+
+        def _terminal(self, data):
+            self.buf += data
+            if self.entered is None:
+                if b'Entering terminal mode' not in self.buf:
+                    return
+                self.entered = time.time()
+                self.buf = self.buf[self.buf.index(b'Entering terminal mode'):]
+
+            now = time.time()
+            end = self.buf.rfind(b'\n') + 1
+            stats['terminal_bytes'] += end
+            for m in ts.finditer(self.buf, 0, end):
+                stats['latency'].append(now - float(m.group(1)))
+                stats['terminal_lines'] += 1
+            self.buf = self.buf[end:]
+
+        def done(self):
+            stats['completed'] += 1
+            self.conn.transport.loseConnection()
+
+    class BenchConnection(connection.SSHConnection):
+        def serviceStarted(self):
+            stats['last_handshake'] = time.time()
+            stats['handshake'].append(stats['last_handshake'] - self.transport.factory.started)
+            self.openChannel(BenchChannel(conn=self))
+
+    class BenchUserAuth(userauth.SSHUserAuthClient):
+        preferredOrder = [b'password']
+
+        def getPassword(self, prompt=None):
+            return defer.succeed(PASSWORD.encode('utf-8'))
+
+    class BenchTransport(transport.SSHClientTransport):
+        def connectionMade(self):
+            stats['connect'].append(time.time() - self.factory.started)
+            transport.SSHClientTransport.connectionMade(self)
+
+        def verifyHostKey(self, pubKey, fingerprint):
+            return defer.succeed(True)
+
+        def connectionSecure(self):
+            self.requestService(BenchUserAuth(USERNAME.encode('utf-8'), BenchConnection()))
+
+    class BenchFactory(protocol.ClientFactory):
+        protocol = BenchTransport
+
+        def __init__(self):
+            self.started = time.time()
+            if stats['first_connect'] is None:
+                stats['first_connect'] = self.started
+
+        def clientConnectionFailed(self, connector, reason):
+            stats['failed'] += 1
+
+    def connect():
+        reactor.connectTCP('127.0.0.1', args.port, BenchFactory())
+
+    start = time.time()
+    for i in range(args.clients):
+        reactor.callLater(i / float(args.connect_rate), connect)
+    ramp = args.clients / float(args.connect_rate)
+    reactor.callLater(ramp + args.duration + 10, reactor.stop)
+    reactor.run()
+
+    # Measured from the first connect to the last completed handshake, not the configured rate.
+    handshakes = stats['handshake']
+    elapsed = stats['last_handshake'] - stats['first_connect'] if handshakes else 0
+    result = dict(
+        handshakes=dict(completed=len(handshakes),
+                        failed=stats['failed'],
+                        per_second=round(len(handshakes) / elapsed, 1) if elapsed > 0 else None,
+                        latency_ms=percentiles(handshakes)),
+        commands=dict((name, percentiles(values)) for name, values in stats['commands'].items()),
+        log_latency_ms=percentiles(stats['latency']),
+        terminal_lines=stats['terminal_lines'],
+        bytes_per_line=round(float(stats['terminal_bytes']) / stats['terminal_lines'], 1) if stats['terminal_lines'] else None,
+        clients_completed=stats['completed'],
+        client_seconds=round(time.time() - start, 2),
+        client_maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--role', choices=('server', 'client'), default='server', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--clients', type=int, default=100, help="number of concurrent SSH clients")
+    parser.add_argument('--connect-rate', type=float, default=50, help="new connections per second")
+    parser.add_argument('--rate', type=float, default=20, help="printer log lines per second")
+    parser.add_argument('--duration', type=float, default=20, help="seconds every client stays in terminal mode")
+    parser.add_argument('--output', help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.role == 'client':
+        run_clients(args)
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    output = json.dumps(run_server(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
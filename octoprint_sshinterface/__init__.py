@@ -1,177 +1,364 @@
-# coding=utf-8
-from __future__ import absolute_import
-
-__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
-__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
-__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
-
-import os
-import time
-import octoprint.plugin
-from octoprint.server import user_permission
-from octoprint.events import eventManager, Events
-import threading
-from twisted.conch.ssh import factory, keys
-from twisted.cred import portal
-from twisted.internet import reactor
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend as crypto_default_backend
-from cryptography.hazmat.primitives import serialization as crypto_serialization
-from fs.osfs import OSFS
-from fs.mountfs import MountFS
-
-
-from . import opsshserver, opsshcommands
-
-class SSHInterface(octoprint.plugin.StartupPlugin,
-                   octoprint.plugin.TemplatePlugin,
-                   octoprint.plugin.AssetPlugin,
-                   octoprint.plugin.EventHandlerPlugin,
-                   octoprint.plugin.SettingsPlugin):
-
-    def __init__(self):
-        self._ssh_thread = None
-        self._terminal_cbs = {}
-        self._terminal_cbs_mutex = threading.Lock()
-        self._plugin_data_dir = ''
-        self.vfs = None
-        self.port = 0
-
-    def on_settings_initialized(self):
-        self._plugin_data_dir = self._settings.global_get_basefolder('data') + os.path.sep + 'sshinterface'
-        if not os.path.isdir(self._plugin_data_dir):
-            try:
-                os.makedirs(self._plugin_data_dir)
-            except:
-                self._logger.error("Unable to create data directory! Path=%s" % self._plugin_data_dir)
-                return
-
-        self.private_key_file = self._plugin_data_dir + '/id_rsa'
-        self.public_key_file = self._plugin_data_dir + '/id_rsa.pub'
-
-        self.port = self._settings.get_int(["port"])
-        self._logger.debug("port: %s" % self.port)
-
-        self.vfs = MountFS()
-        for basefolder in ['uploads', 'scripts', 'logs']:
-            self.vfs.mount(basefolder, OSFS(self._settings.global_get_basefolder(basefolder)))
-
-        self._ssh_thread = threading.Thread(target=self._run_ssh)
-        self._ssh_thread.setDaemon(True)
-        self._ssh_thread.start()
-
-    def _load_ssh_keypair(self):
-        with open(self.private_key_file, "rb") as f:
-            privateBlob = f.read()
-            privateKey = keys.Key.fromString(data=privateBlob)
-
-        with open(self.public_key_file, "rb") as f:
-            publicBlob = f.read()
-            publicKey = keys.Key.fromString(data=publicBlob)
-
-        return publicKey, privateKey
-
-    def _create_ssh_keypair(self, key_size):
-        key = rsa.generate_private_key(
-            backend=crypto_default_backend(),
-            public_exponent=65537,
-            key_size=key_size
-        )
-        private_key = key.private_bytes(
-            crypto_serialization.Encoding.PEM,
-            crypto_serialization.PrivateFormat.TraditionalOpenSSL,
-            crypto_serialization.NoEncryption())
-        public_key = key.public_key().public_bytes(
-            crypto_serialization.Encoding.OpenSSH,
-            crypto_serialization.PublicFormat.OpenSSH
-        )
-
-        # TODO: Set appropriate permissions
-        with open(self.private_key_file, "w") as f:
-            f.write(private_key)
-
-        with open(self.public_key_file, "w") as f:
-            f.write(public_key)
-
-
-    def _run_ssh(self):
-        sshFactory = factory.SSHFactory()
-        sshFactory.services[b'ssh-userauth'] = opsshserver.OPSSHUserAuthServer
-
-        sshFactory.portal = opsshserver.OPSSHPortal(opsshserver.OPSSHRealm(opsshcommands.available_commands))
-
-        sshFactory.portal.registerChecker(opsshserver.OPSSHCredentialChecker(self))
-        sshFactory.portal.registerChecker(opsshserver.OPSSHPublicKeyChecker(self))
-
-        if not os.path.isfile(self.private_key_file) and not os.path.isfile(self.public_key_file):
-            self._create_ssh_keypair(2048)
-
-        pubKey, privKey = self._load_ssh_keypair()
-
-        sshFactory.publicKeys = {b'ssh-rsa': pubKey}
-        sshFactory.privateKeys = {b'ssh-rsa': privKey}
-
-        sshFactory.protocol._OctoPrintSSH = self
-
-        reactor.listenTCP(self.port, sshFactory)
-        reactor.run(installSignalHandlers=0)
-
-    def _on_printer_add_log(self, data):
-        with self._terminal_cbs_mutex:
-            for name, callback in self._terminal_cbs.items():
-                try:
-                    reactor.callFromThread(callback, data)
-                except:
-                    self._logger.exception("Error while processing callback for sessionno %s" % name)
-
-    def on_event(self, event, payload):
-        if event == Events.CONNECTED:
-            cb = octoprint.printer.PrinterCallback()
-            cb.on_printer_add_log = self._on_printer_add_log
-            self._printer.register_callback(cb)
-
-
-    def get_settings_defaults(self):
-        return dict(
-            port = 2222
-        )
-
-    def get_template_configs(self):
-        return [
-            dict(type="settings", custom_bindings=True),
-            dict(type="usersettings", custom_bindings=True)
-        ]
-
-    def get_assets(self):
-        return {
-            "js": ["js/sshinterface.js"]
-        }
-
-    def get_update_information(self):
-        return dict(
-            tcpterminal=dict(
-                displayName="SSH Interface",
-                displayVersion=self._plugin_version,
-
-                # version check: github repository
-                type="github_release",
-                user="kantlivelong",
-                repo="OctoPrint-SSHInterface",
-                current=self._plugin_version,
-
-                # update method: pip w/ dependency links
-                pip="https://github.com/kantlivelong/OctoPrint-SSHInterface/archive/{target_version}.zip"
-            )
-        )
-
-__plugin_name__ = "SSH Interface"
-__plugin_pythoncompat__ = ">=2.7,<4"
-
-def __plugin_load__():
-    global __plugin_implementation__
-    __plugin_implementation__ = SSHInterface()
-
-    global __plugin_hooks__
-    __plugin_hooks__ = {
-        "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information
-    }
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import logging
+import os
+import time
+import octoprint.plugin
+from octoprint.server import user_permission
+from octoprint.events import eventManager, Events
+import threading
+
+from . import opsshloop
+
+
+def _install_reactor():
+    # Twisted only allows choosing the reactor before twisted.internet.reactor is first
+    # imported, and OctoPrint has no plugin hook that runs before this module's imports.
+    # Whatever is installed here is shared by every plugin using Twisted.
+    logger = logging.getLogger("octoprint.plugins.sshinterface")
+    try:
+        from octoprint.settings import settings
+        name = settings().get(["plugins", "sshinterface", "reactor"]) or 'default'
+    except Exception:
+        logger.warning("Unable to read the reactor setting, using the default reactor", exc_info=True)
+        return
+
+    if name == 'default':
+        return
+
+    try:
+        if not opsshloop.install_reactor(name):
+            logger.warning("Reactor {} was not installed, a reactor is already in use or the name is unknown".format(name))
+    except Exception:
+        logger.warning("Unable to install reactor {}, using the default reactor".format(name), exc_info=True)
+_install_reactor()
+
+from twisted.conch.ssh import keys
+from twisted.internet import defer, reactor
+from twisted.internet.error import CannotListenError
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.backends import default_backend as crypto_default_backend
+from cryptography.hazmat.primitives import serialization as crypto_serialization
+from fs.osfs import OSFS
+from fs.mountfs import MountFS
+
+
+from . import opsshserver, opsshcommands, opsshsessions, opsshindex, opsshstorage, opsshcache, opsshqueue, opsshstreams, opsshusers, opsshstatus, opsshrecord
+
+class SSHInterface(octoprint.plugin.StartupPlugin,
+                   octoprint.plugin.ShutdownPlugin,
+                   octoprint.plugin.TemplatePlugin,
+                   octoprint.plugin.AssetPlugin,
+                   octoprint.plugin.EventHandlerPlugin,
+                   octoprint.plugin.SettingsPlugin):
+
+    def __init__(self):
+        self.loop = opsshloop.OPSSHEventLoop(logging.getLogger("octoprint.plugins.sshinterface"))
+        self._ssh_factory = None
+        self._listener = None
+        self._listen_address = None
+        self._listen_lock = defer.DeferredLock()
+        self._printer_callback = None
+        self._terminal_cbs = {}
+        self._terminal_cbs_mutex = threading.Lock()
+        self._plugin_data_dir = ''
+        self.vfs = None
+        self.port = 0
+        self.bind_address = ''
+        self.http_port = None
+        self.sessions = None
+        self.users = None
+        self.path_index = None
+        self.history = None
+        self.recorder = None
+        self.metadata_cache = opsshcache.OPSSHFileCache()
+        self.print_queue = None
+        self.event_hub = opsshstreams.OPSSHEventHub(self.loop.call_from_thread)
+        self.status = opsshstatus.OPSSHStatusBroadcast(self.loop.call_from_thread)
+        self.profiler = None
+
+    def on_settings_initialized(self):
+        self._plugin_data_dir = self._settings.global_get_basefolder('data') + os.path.sep + 'sshinterface'
+        if not os.path.isdir(self._plugin_data_dir):
+            try:
+                os.makedirs(self._plugin_data_dir)
+            except:
+                self._logger.error("Unable to create data directory! Path=%s" % self._plugin_data_dir)
+                return
+
+        self.private_key_file = self._plugin_data_dir + '/id_rsa'
+        self.public_key_file = self._plugin_data_dir + '/id_rsa.pub'
+
+        self.port = self._settings.get_int(["port"])
+        self.bind_address = self._settings.get(["bind_address"]) or ''
+        self._logger.debug("port: %s" % self.port)
+
+        self.vfs = MountFS()
+        for basefolder in ['uploads', 'scripts', 'logs']:
+            self.vfs.mount(basefolder, OSFS(self._settings.global_get_basefolder(basefolder)))
+        self.path_index = opsshindex.OPSSHPathIndex(self.vfs, ['uploads'], ['uploads', 'scripts', 'logs'], self._logger)
+
+        self.sessions = opsshsessions.OPSSHSessionManager(self)
+        self.users = opsshusers.OPSSHUserDirectory(self, self._on_user_changed)
+        self.history = opsshstorage.OPSSHHistoryStore(self, os.path.join(self._plugin_data_dir, 'history'))
+        self.recorder = opsshrecord.OPSSHSessionRecorder(self, os.path.join(self._plugin_data_dir, 'recordings'))
+        self.print_queue = opsshqueue.OPSSHPrintQueue(self, os.path.join(self._plugin_data_dir, 'queue.json'))
+
+        self._printer_callback = octoprint.printer.PrinterCallback()
+        self._printer_callback.on_printer_add_log = self._on_printer_add_log
+        self._printer_callback.on_printer_send_current_data = self.status.update
+        self._printer.register_callback(self._printer_callback)
+
+        self.loop.start(self._run_ssh)
+
+    def _load_ssh_keypair(self):
+        with open(self.private_key_file, "rb") as f:
+            privateBlob = f.read()
+            privateKey = keys.Key.fromString(data=privateBlob)
+
+        with open(self.public_key_file, "rb") as f:
+            publicBlob = f.read()
+            publicKey = keys.Key.fromString(data=publicBlob)
+
+        return publicKey, privateKey
+
+    def _create_ssh_keypair(self, key_size):
+        key = rsa.generate_private_key(
+            backend=crypto_default_backend(),
+            public_exponent=65537,
+            key_size=key_size
+        )
+        private_key = key.private_bytes(
+            crypto_serialization.Encoding.PEM,
+            crypto_serialization.PrivateFormat.TraditionalOpenSSL,
+            crypto_serialization.NoEncryption())
+        public_key = key.public_key().public_bytes(
+            crypto_serialization.Encoding.OpenSSH,
+            crypto_serialization.PublicFormat.OpenSSH
+        )
+
+        # TODO: Set appropriate permissions
+        with open(self.private_key_file, "wb") as f:
+            f.write(private_key)
+
+        with open(self.public_key_file, "wb") as f:
+            f.write(public_key)
+
+
+    def _run_ssh(self):
+        self._ssh_factory = opsshserver.OPSSHFactory(self)
+        self._ssh_factory.services[b'ssh-userauth'] = opsshserver.OPSSHUserAuthServer
+
+        self._ssh_factory.portal = opsshserver.OPSSHPortal(opsshserver.OPSSHRealm(opsshcommands.available_commands, opsshstreams.available_exec_commands))
+
+        self._ssh_factory.portal.registerChecker(opsshserver.OPSSHCredentialChecker(self))
+        self._ssh_factory.portal.registerChecker(opsshserver.OPSSHPublicKeyChecker(self))
+
+        self._ssh_factory.protocol._OctoPrintSSH = self
+
+        self._load_host_keys()
+        self._listen()
+        self.sessions.start()
+        self.history.start()
+        self.recorder.start()
+        self.users.start()
+
+    def _load_host_keys(self):
+        if not os.path.isfile(self.private_key_file) and not os.path.isfile(self.public_key_file):
+            self._create_ssh_keypair(2048)
+
+        pubKey, privKey = self._load_ssh_keypair()
+
+        # Existing connections keep their keys, new ones pick these up.
+        self._ssh_factory.publicKeys = {b'ssh-rsa': pubKey}
+        self._ssh_factory.privateKeys = {b'ssh-rsa': privKey}
+
+    def _listen(self):
+        return self._listen_lock.run(self._rebind)
+
+    def _rebind(self):
+        # The old listener is only closed once the new one is bound, so a bad port or
+        # address leaves the server reachable where it was.
+        listener, address = self._listener, self._listen_address
+        try:
+            self._listen_port(self.port, self.bind_address)
+        except CannotListenError as e:
+            if listener is None or address[0] != self.port:
+                self._logger.error("Unable to listen on port {}: {}".format(self.port, e))
+                return None
+
+            # The same port on another address can only be bound once the old listener is closed.
+            return defer.maybeDeferred(listener.stopListening).addCallback(self._listen_or_restore, address)
+
+        if listener is not None:
+            return defer.maybeDeferred(listener.stopListening)
+
+    def _listen_port(self, port, bind_address):
+        self._listener = reactor.listenTCP(port, self._ssh_factory, interface=bind_address)
+        self._listen_address = (port, bind_address)
+        self._logger.info("Listening on port {}".format(port))
+
+    def _listen_or_restore(self, result, address):
+        self._listener = self._listen_address = None
+        try:
+            self._listen_port(self.port, self.bind_address)
+        except CannotListenError as e:
+            self._logger.error("Unable to listen on port {}: {}, listening on {} again".format(self.port, e, address[1] or '*'))
+            try:
+                self._listen_port(*address)
+            except CannotListenError as e:
+                self._logger.error("Unable to listen on port {}: {}".format(address[0], e))
+
+    def _reload_server(self):
+        if self._ssh_factory is None:
+            return
+
+        try:
+            self._load_host_keys()
+        except Exception:
+            self._logger.exception("Unable to load host keys")
+
+        port = self._settings.get_int(["port"])
+        bind_address = self._settings.get(["bind_address"]) or ''
+        if (port, bind_address) != self._listen_address:
+            self.port = port
+            self.bind_address = bind_address
+            self._listen()
+
+    def on_startup(self, host, port):
+        self.http_port = port
+
+    def on_settings_save(self, data):
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        self.loop.call_from_thread(self._reload_server)
+
+    def on_shutdown(self):
+        if self.history:
+            if self.loop.running:
+                self.loop.call_blocking(self.history.stop)
+            else:
+                self.history.flush()
+
+        if self.recorder:
+            if self.loop.running:
+                self.loop.call_blocking(self.recorder.stop)
+            else:
+                self.recorder.flush()
+
+        if self.print_queue:
+            self.print_queue.flush()
+
+        if self._printer_callback:
+            self._printer.unregister_callback(self._printer_callback)
+            self._printer_callback = None
+
+        if self.profiler:
+            self.profiler.stop()
+
+        if self.users:
+            self.loop.call_from_thread(self.users.stop)
+
+        self.loop.stop()
+
+    def _on_printer_add_log(self, data):
+        if self._terminal_cbs:
+            self.loop.call_from_thread(self._dispatch_printer_log, data)
+
+    def _dispatch_printer_log(self, data):
+        with self._terminal_cbs_mutex:
+            callbacks = list(self._terminal_cbs.items())
+
+        for name, callback in callbacks:
+            try:
+                callback(data)
+            except:
+                self._logger.exception("Error while processing terminal callback %s" % (name,))
+
+    def _on_user_changed(self, previous, snapshot):
+        if previous.is_active and not snapshot.is_active:
+            self.loop.call_from_thread(self._disconnect_user, snapshot.name)
+
+    def _disconnect_user(self, username):
+        if self._ssh_factory:
+            self._logger.info("Disconnecting {}: account disabled or removed".format(username))
+            self._ssh_factory.disconnectUser(username.encode(), b"Account disabled")
+
+    def on_event(self, event, payload):
+        if self.path_index:
+            self.path_index.on_event(event, payload)
+
+        self.event_hub.publish(event, payload)
+
+        if event == Events.PRINT_DONE and self.print_queue:
+            self.loop.call_from_thread(self.print_queue.start_next)
+
+
+    def get_settings_defaults(self):
+        return dict(
+            port = 2222,
+            bind_address = '',
+            session_idle_timeout = 0,
+            session_max_time = 0,
+            keepalive_interval = 15,
+            keepalive_max_count = 3,
+            max_connections = 10,
+            max_connections_per_user = 4,
+            max_unauthenticated = 3,
+            login_grace_time = 60,
+            history_size = 1000,
+            send_window = 8,
+            send_ack_timeout = 300,
+            hash_workers = 2,
+            compression = True,
+            compression_level = 6,
+            recording = False,
+            recording_max_size = 10,
+            recording_backups = 5,
+            forward_ports = '',
+            reactor = 'default'
+        )
+
+    def get_template_configs(self):
+        return [
+            dict(type="settings", custom_bindings=True),
+            dict(type="usersettings", custom_bindings=True)
+        ]
+
+    def get_assets(self):
+        return {
+            "js": ["js/sshinterface.js"]
+        }
+
+    def get_update_information(self):
+        return dict(
+            tcpterminal=dict(
+                displayName="SSH Interface",
+                displayVersion=self._plugin_version,
+
+                # version check: github repository
+                type="github_release",
+                user="kantlivelong",
+                repo="OctoPrint-SSHInterface",
+                current=self._plugin_version,
+
+                # update method: pip w/ dependency links
+                pip="https://github.com/kantlivelong/OctoPrint-SSHInterface/archive/{target_version}.zip"
+            )
+        )
+
+__plugin_name__ = "SSH Interface"
+__plugin_pythoncompat__ = ">=2.7,<4"
+
+def __plugin_load__():
+    global __plugin_implementation__
+    __plugin_implementation__ = SSHInterface()
+
+    global __plugin_hooks__
+    __plugin_hooks__ = {
+        "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information
+    }
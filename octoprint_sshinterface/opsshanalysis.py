@@ -0,0 +1,128 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import math
+import re
+
+CHUNK_SIZE = 1024 * 1024
+
+_word = re.compile(br'([A-Z])\s*([-+]?\d*\.?\d+)')
+
+
+class OPSSHAnalysisAborted(Exception):
+    pass
+
+
+def analyze_gcode(f, filament_diameter=1.75, abort=None, chunk_size=CHUNK_SIZE):
+    # Single pass over the binary file f producing a result shaped like OctoPrint's own gcode analysis.
+    # Print time is estimated from distance and feedrate only, without acceleration.
+    pos = [0.0, 0.0, 0.0]
+    e = 0.0
+    feedrate = 3000.0
+    relative = False
+    relative_e = False
+    tool = 0
+    extruded = {}
+    area = [float('inf'), float('-inf')] * 3
+    seconds = 0.0
+
+    carry = b''
+    while True:
+        data = f.read(chunk_size)
+        if abort is not None and abort():
+            raise OPSSHAnalysisAborted()
+
+        if data:
+            data = carry + data
+            end = data.rfind(b'\n') + 1
+            carry = data[end:]
+            lines = data[:end].split(b'\n')
+        else:
+            lines = [carry]
+
+        for line in lines:
+            line = line.split(b';', 1)[0].strip().upper()
+            if not line:
+                continue
+
+            if line[:1] == b'T':
+                try:
+                    tool = int(line[1:].split()[0])
+                except (ValueError, IndexError):
+                    pass
+                continue
+
+            words = dict(_word.findall(line))
+            g = words.get(b'G')
+            m = words.get(b'M')
+
+            if g in (b'0', b'1', b'00', b'01'):
+                new = list(pos)
+                for i, axis in enumerate((b'X', b'Y', b'Z')):
+                    if axis in words:
+                        value = float(words[axis])
+                        new[i] = new[i] + value if relative else value
+                if b'F' in words:
+                    feedrate = float(words[b'F']) or feedrate
+
+                delta_e = 0.0
+                if b'E' in words:
+                    value = float(words[b'E'])
+                    delta_e = value if relative or relative_e else value - e
+                    e = e + value if relative or relative_e else value
+
+                distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(new, pos)))
+                moved = distance or abs(delta_e)
+                if moved:
+                    seconds += moved / feedrate * 60.0
+
+                if delta_e > 0:
+                    extruded[tool] = extruded.get(tool, 0.0) + delta_e
+                    for i in range(3):
+                        area[i * 2] = min(area[i * 2], pos[i], new[i])
+                        area[i * 2 + 1] = max(area[i * 2 + 1], pos[i], new[i])
+                pos = new
+            elif g == b'4':
+                if b'S' in words:
+                    seconds += float(words[b'S'])
+                elif b'P' in words:
+                    seconds += float(words[b'P']) / 1000.0
+            elif g == b'28':
+                for i, axis in enumerate((b'X', b'Y', b'Z')):
+                    if axis in words or not any(a in words for a in (b'X', b'Y', b'Z')):
+                        pos[i] = 0.0
+            elif g == b'90':
+                relative = False
+                relative_e = False
+            elif g == b'91':
+                relative = True
+            elif g == b'92':
+                for i, axis in enumerate((b'X', b'Y', b'Z')):
+                    if axis in words:
+                        pos[i] = float(words[axis])
+                if b'E' in words:
+                    e = float(words[b'E'])
+            elif m == b'82':
+                relative_e = False
+            elif m == b'83':
+                relative_e = True
+
+        if not data:
+            break
+
+    if not extruded:
+        area = [0.0] * 6
+
+    cross_section = math.pi * (filament_diameter / 2.0) ** 2
+    filament = {}
+    for t, length in extruded.items():
+        filament["tool{}".format(t)] = dict(length=length, volume=length * cross_section / 1000.0)
+
+    return dict(estimatedPrintTime=seconds,
+                filament=filament,
+                printingArea=dict(minX=area[0], maxX=area[1], minY=area[2], maxY=area[3], minZ=area[4], maxZ=area[5]),
+                dimensions=dict(width=area[1] - area[0], depth=area[3] - area[2], height=area[5] - area[4]))
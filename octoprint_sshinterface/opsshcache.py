@@ -0,0 +1,38 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import os
+import collections
+import threading
+
+
+class OPSSHFileCache(object):
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._mutex = threading.Lock()
+
+    @staticmethod
+    def key(syspath, *extra):
+        st = os.stat(syspath)
+        return (syspath, st.st_size, st.st_mtime) + extra
+
+    def get(self, key, default=None):
+        with self._mutex:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._mutex:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
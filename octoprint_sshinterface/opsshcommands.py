@@ -6,10 +6,28 @@ __license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agp
 __copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
 
 import os
+import re
+import math
+import shutil
+import time
+import getopt
+import fnmatch
+import collections
 import asciichartpy
 from octoprint.access.permissions import Permissions
+from octoprint.filemanager.destinations import FileDestinations
 from twisted.conch.insults import insults
+from twisted.internet import defer, reactor, threads
 from .opsshserver import OPSSHShell
+from .opsshpipeline import read_lines
+from . import opsshgrep
+from .opsshanalysis import analyze_gcode, OPSSHAnalysisAborted
+from .opsshhash import hash_file, OPSSHHashAborted
+from .opsshprofile import OPSSHSamplingProfiler
+from .opsshstreams import OPSSHLineBuffer
+from .opsshsend import OPSSHAckMatcher
+from .opsshqueue import is_printable
+from .opsshstatus import render_status, status_lines
 
 class OPSSHCommand(object):
     _name_ = "commandname"
@@ -17,11 +35,17 @@ class OPSSHCommand(object):
     _description_ = """
     Detailed usage information.
     """
+    _pipeable_ = False
 
     def __init__(self, shell):
         self.shell = shell
         self.terminal = shell.terminal
 
+    def abspath(self, path):
+        if path[0] != '/':
+            path = os.path.join(self.shell.pwd, path)
+        return path
+
     def help(self):
         self.terminal.write("{} - {}".format(self._name_, self._short_description_))
         self.terminal.nextLine()
@@ -31,6 +55,40 @@ class OPSSHCommand(object):
     def main(self, *args):
         self.help()
 
+    def prepare(self, *args):
+        # Pipeable commands may return a Deferred the pipeline waits for before streaming.
+        return None
+
+    def stream(self, stdin, *args):
+        raise NotImplementedError()
+
+    def after_index(self, callback, *args):
+        # Calls callback once the path index has a snapshot. Returns self while waiting, so it can
+        # be returned from main() to keep the command running, and None if callback already ran.
+        d = self.shell._OctoPrintSSH.path_index.ready()
+        if d.called:
+            callback(*args)
+            return None
+
+        self._index_wait = d
+        d.addCallbacks(self._indexed, self._index_failed, callbackArgs=(callback, args))
+        return self
+
+    def _indexed(self, result, callback, args):
+        if getattr(self, '_index_wait', None) is None:
+            return
+        self._index_wait = None
+        callback(*args)
+        self.shell.commandFinished(self)
+
+    def _index_failed(self, failure):
+        if getattr(self, '_index_wait', None) is None:
+            return
+        self._index_wait = None
+        self.terminal.write("{}: unable to read the file index".format(self._name_))
+        self.terminal.nextLine()
+        self.shell.commandFinished(self)
+
     def term(self):
         raise NotImplementedError()
 
@@ -46,6 +104,9 @@ class OPSSHCommand(object):
     def handle_CTRL_U(self):
         raise NotImplementedError()
 
+    def handle_TAB(self):
+        raise NotImplementedError()
+
     def lineReceived(self, line):
         raise NotImplementedError()
 
@@ -57,6 +118,21 @@ class OPSSHCommand(object):
 available_commands = []
 
 
+def format_size(size):
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(size) < 1024 or unit == 'G':
+            break
+        size /= 1024.0
+    return "{:.0f}{}".format(size, unit) if unit == 'B' else "{:.1f}{}".format(size, unit)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
 class OPSSHCommand_help(OPSSHCommand):
     _name_ = "help"
     _short_description_ = "Provides a list of available commands."
@@ -131,16 +207,293 @@ class OPSSHCommand_whoami(OPSSHCommand):
 available_commands.append(OPSSHCommand_whoami)
 
 
+class OPSSHCommand_who(OPSSHCommand):
+    _name_ = "who"
+    _short_description_ = "Show who is logged on"
+    _description_ = ""
+
+    def main(self, *args):
+        output_format = u"{id: <4} {user: <16} {peer: <22} {started: <19} {idle: >6} {sent: >10}  {command}"
+        self.terminal.write(output_format.format(id='ID', user='USER', peer='FROM', started='LOGIN@', idle='IDLE', sent='SENT', command='WHAT'))
+        self.terminal.nextLine()
+
+        now = time.time()
+        for id, entry in sorted(self.shell._OctoPrintSSH.sessions.sessions.items()):
+            self.terminal.write(output_format.format(id=id,
+                                                     user=entry.user,
+                                                     peer=entry.peer,
+                                                     started=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.started)),
+                                                     idle="{}s".format(int(now - entry.last_activity)),
+                                                     sent=entry.bytes_sent,
+                                                     command=entry.command or '-'))
+            self.terminal.nextLine()
+available_commands.append(OPSSHCommand_who)
+
+
+class OPSSHCommand_kill(OPSSHCommand):
+    _name_ = "kill"
+    _short_description_ = "Terminate a session"
+    _description_ = """
+    kill [ID]
+    """
+
+    def main(self, *args):
+        if len(args) != 2:
+            self.help()
+            return
+
+        try:
+            id = int(args[1])
+        except ValueError:
+            self.terminal.write("kill: {}: invalid session id".format(args[1]))
+            self.terminal.nextLine()
+            return
+
+        sessions = self.shell._OctoPrintSSH.sessions
+        entry = sessions.sessions.get(id)
+        if entry is None:
+            self.terminal.write("kill: {}: no such session".format(id))
+            self.terminal.nextLine()
+            return
+
+        if entry.user != self.shell.session.user and not Permissions.ADMIN in self.shell.user.effective_permissions:
+            self.terminal.write("Access denied.")
+            self.terminal.nextLine()
+            return
+
+        sessions.kill(id, "Session terminated by {}.".format(self.shell.session.user))
+available_commands.append(OPSSHCommand_kill)
+
+
+class OPSSHCommand_profile(OPSSHCommand):
+    _name_ = "profile"
+    _short_description_ = "Profile the SSH server thread."
+    _description_ = """
+    profile start [INTERVAL_MS]
+    profile stop
+    profile dump
+
+    Samples the stack of the SSH server thread. stop and dump write the
+    collapsed stacks to /logs for flamegraph.pl or speedscope, stop also ends
+    sampling. Only available to administrators.
+    """
+
+    def main(self, *args):
+        if not Permissions.ADMIN in self.shell.user.effective_permissions:
+            self.terminal.write("Access denied.")
+            self.terminal.nextLine()
+            return
+
+        plugin = self.shell._OctoPrintSSH
+        action = args[1] if len(args) > 1 else None
+
+        if action == 'start' and len(args) <= 3:
+            if plugin.profiler is not None:
+                self.terminal.write("profile: already running")
+                self.terminal.nextLine()
+                return
+
+            try:
+                interval = float(args[2]) if len(args) > 2 else 5.0
+                if interval <= 0:
+                    raise ValueError()
+            except ValueError:
+                self.terminal.write("profile: {}: invalid interval".format(args[2]))
+                self.terminal.nextLine()
+                return
+
+            plugin.profiler = OPSSHSamplingProfiler(plugin.loop.ident, interval / 1000.0)
+            plugin.profiler.start()
+            self.terminal.write("Sampling every {:g} ms.".format(interval))
+            self.terminal.nextLine()
+        elif action in ('stop', 'dump') and len(args) == 2:
+            profiler = plugin.profiler
+            if profiler is None:
+                self.terminal.write("profile: not running")
+                self.terminal.nextLine()
+                return
+
+            if action == 'stop':
+                profiler.stop()
+                plugin.profiler = None
+
+            name = "sshinterface_profile_{}.folded".format(time.strftime("%Y%m%d-%H%M%S"))
+            try:
+                stacks = profiler.dump(plugin.vfs.getsyspath('/logs/' + name))
+            except Exception as e:
+                self.terminal.write("profile: unable to write /logs/{}: {}".format(name, e))
+                self.terminal.nextLine()
+                return
+            plugin.path_index.invalidate('logs')
+
+            self.terminal.write("Wrote {} stacks from {} samples over {} to /logs/{}".format(stacks, profiler.samples, format_duration(time.time() - profiler.started), name))
+            self.terminal.nextLine()
+            for label, samples in profiler.top():
+                self.terminal.write("  {:5.1f}%  {}".format(100.0 * samples / profiler.samples, label))
+                self.terminal.nextLine()
+        else:
+            self.help()
+available_commands.append(OPSSHCommand_profile)
+
+
+class OPSSHCommand_replay(OPSSHCommand):
+    _name_ = "replay"
+    _short_description_ = "Play back recorded sessions."
+    _description_ = """
+    replay
+    replay [-s SPEED] NUMBER
+
+    Without arguments lists the recorded sessions, otherwise plays back the
+    output of the given recording. Pauses longer than two seconds are
+    shortened. Administrators can replay every session, other users only
+    their own.
+
+    -s  playback speed, 2 plays twice as fast
+    """
+    max_idle = 2.0
+    max_pending = 64 * 1024
+
+    def main(self, *args):
+        try:
+            opts, rest = getopt.getopt(args[1::], 's:')
+            opts = dict(opts)
+            self.speed = float(opts.get('-s', 1))
+            if self.speed <= 0:
+                raise ValueError()
+            self.number = int(rest[0]) if rest else None
+            if len(rest) > 1:
+                raise ValueError()
+        except (getopt.GetoptError, ValueError):
+            self.help()
+            return
+
+        self._cancelled = False
+        self._call = None
+        self.recording = None
+        self.shell._OctoPrintSSH.recorder.index().addCallbacks(self._indexed, self._failed)
+        return self
+
+    def _visible(self, recordings):
+        if Permissions.ADMIN in self.shell.user.effective_permissions:
+            return recordings
+        return [r for r in recordings if r.get('user') == self.shell.session.user]
+
+    def _failed(self, failure):
+        if self._cancelled:
+            return
+        self.terminal.write("replay: unable to read recordings: {}".format(failure.getErrorMessage()))
+        self.terminal.nextLine()
+        self.shell.commandFinished(self)
+
+    def _indexed(self, recordings):
+        if self._cancelled:
+            return
+
+        recordings = self._visible(recordings)
+        if self.number is None:
+            self._list(recordings)
+            self.shell.commandFinished(self)
+            return
+
+        if not 0 < self.number <= len(recordings):
+            self.terminal.write("replay: {}: no such recording".format(self.number))
+            self.terminal.nextLine()
+            self.shell.commandFinished(self)
+            return
+
+        self.shell._OctoPrintSSH.recorder.events(recordings[self.number - 1]).addCallbacks(self._loaded, self._failed)
+
+    def _loaded(self, events):
+        if self._cancelled:
+            return
+
+        # The played back output is not recorded again into this session's own recording.
+        self.recording = self.shell.ssh_session.channel.recording
+        if self.recording:
+            self.recording.paused = True
+
+        self.events = events
+        self.position = 0
+        self.clock = 0
+        self._play()
+
+    def _list(self, recordings):
+        output_format = u"{number: >4}  {user: <16} {peer: <22} {started: <19} {duration: >8} {size: >7}"
+        self.terminal.write(output_format.format(number='#', user='USER', peer='FROM', started='STARTED', duration='TIME', size='SIZE'))
+        self.terminal.nextLine()
+        for number, recording in enumerate(recordings, 1):
+            started = recording.get('started')
+            self.terminal.write(output_format.format(number=number,
+                                                     user=recording.get('user', '?'),
+                                                     peer=recording.get('peer', '?'),
+                                                     started=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)) if started else '?',
+                                                     duration=format_duration(recording['duration'] / 1000.0),
+                                                     size=format_size(recording['size'])))
+            self.terminal.nextLine()
+
+    def _play(self):
+        self._call = None
+        if self._cancelled:
+            return
+
+        if self.shell.outputPending() > self.max_pending:
+            self._call = reactor.callLater(0.05, self._play)
+            return
+
+        # Everything recorded within the same millisecond goes out in one write.
+        chunks = []
+        while self.position < len(self.events) and self.events[self.position][1] <= self.clock:
+            chunks.append(self.events[self.position][2])
+            self.position += 1
+        if chunks:
+            self.terminal.transport.write(b''.join(chunks))
+
+        if self.position >= len(self.events):
+            self._resume_recording()
+            self.terminal.write("\x1b[0m")
+            self.terminal.nextLine()
+            self.terminal.write("-- end of recording --")
+            self.terminal.nextLine()
+            self.shell.commandFinished(self)
+            return
+
+        offset = self.events[self.position][1]
+        delay = min((offset - self.clock) / 1000.0, self.max_idle) / self.speed
+        self.clock = offset
+        self._call = reactor.callLater(delay, self._play)
+
+    def _resume_recording(self):
+        if self.recording:
+            self.recording.paused = False
+        self.recording = None
+
+    def term(self):
+        self._cancelled = True
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._resume_recording()
+        self.terminal.write("\x1b[0m")
+        self.terminal.nextLine()
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_replay)
+
+
 class OPSSHCommand_echo(OPSSHCommand):
     _name_ = "echo"
     _short_description_ = "Display a line of text"
     _description_ = """
     echo [STRING]
     """
+    _pipeable_ = True
 
-    def main(self, *args):
-        self.terminal.write(' '.join(args[1::]))
-        self.terminal.nextLine()
+    def stream(self, stdin, *args):
+        yield [' '.join(args[1::])]
 available_commands.append(OPSSHCommand_echo)
 
 
@@ -202,8 +555,9 @@ class OPSSHCommand_ls(OPSSHCommand):
     _description_ = """
     ls [FILE]
     """
+    _pipeable_ = True
 
-    def main(self, *args):
+    def stream(self, stdin, *args):
         if len(args) == 1:
             paths = [self.shell.pwd]
         elif len(args) >= 2:
@@ -213,25 +567,23 @@ class OPSSHCommand_ls(OPSSHCommand):
             #FIXME: setting to unicode makes work on py2 but still breaks on py3. whats the best way?
             #path = unicode(path)
 
-            if path[0] != '/':
-                path = os.path.join(self.shell.pwd, path)
+            path = self.abspath(path)
 
+            lines = []
             if self.shell._OctoPrintSSH.vfs.isdir(path):
                 if len(args) > 2:
-                    self.terminal.write("{}:".format(path))
-                    self.terminal.nextLine()
-                for i in self.shell._OctoPrintSSH.vfs.listdir(path):
-                    self.terminal.write(i)
-                    self.terminal.nextLine()
+                    lines.append("{}:".format(path))
+                lines.extend(self.shell._OctoPrintSSH.vfs.listdir(path))
             elif self.shell._OctoPrintSSH.vfs.isfile(path):
-                self.terminal.write(path)
-                self.terminal.nextLine()
+                lines.append(path)
             else:
                 self.terminal.write("ls: cannot access '{}': No such file or directory".format(path))
                 self.terminal.nextLine()
 
             if len(paths) > 1:
-                self.terminal.nextLine()
+                lines.append('')
+
+            yield lines
 available_commands.append(OPSSHCommand_ls)
 
 
@@ -241,8 +593,14 @@ class OPSSHCommand_cat(OPSSHCommand):
     _description_ = """
     cat [FILE]
     """
+    _pipeable_ = True
+
+    def stream(self, stdin, *args):
+        if len(args) == 1 and stdin is not None:
+            for chunk in stdin:
+                yield chunk
+            return
 
-    def main(self, *args):
         if len(args) == 1:
             paths = [self.shell.pwd]
         elif len(args) >= 2:
@@ -252,29 +610,503 @@ class OPSSHCommand_cat(OPSSHCommand):
             #FIXME: setting to unicode makes work on py2 but still breaks on py3. whats the best way?
             #path = unicode(path)
 
-            if path[0] != '/':
-                path = os.path.join(self.shell.pwd, path)
+            path = self.abspath(path)
 
             if self.shell._OctoPrintSSH.vfs.isdir(path):
                 self.terminal.write("cat: {}: Is a directory".format(path))
                 self.terminal.nextLine()
+                continue
+
+            try:
+                f = self.shell._OctoPrintSSH.vfs.openbin(path)
+            except Exception:
+                self.terminal.write("cat: {}: No such file".format(path))
+                self.terminal.nextLine()
+                continue
+
+            with f:
+                for chunk in read_lines(f):
+                    yield chunk
+available_commands.append(OPSSHCommand_cat)
+
+
+class OPSSHCommand_head(OPSSHCommand):
+    _name_ = "head"
+    _short_description_ = "output the first part of files"
+    _description_ = """
+    head [-n LINES] [FILE]
+    """
+    _pipeable_ = True
+
+    def stream(self, stdin, *args):
+        try:
+            opts, paths = getopt.getopt(args[1::], 'n:')
+            count = int(dict(opts).get('-n', 10))
+        except (getopt.GetoptError, ValueError) as e:
+            self.terminal.write("head: {}".format(e))
+            self.terminal.nextLine()
+            return
+
+        if paths:
+            source = OPSSHCommand_cat(self.shell).stream(None, 'cat', *paths)
+        else:
+            source = stdin or []
+
+        try:
+            for chunk in source:
+                yield chunk[:count]
+                count -= len(chunk)
+                if count <= 0:
+                    break
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+available_commands.append(OPSSHCommand_head)
+
+
+class OPSSHCommand_tail(OPSSHCommand):
+    _name_ = "tail"
+    _short_description_ = "output the last part of files"
+    _description_ = """
+    tail [-n LINES] [FILE]
+    """
+    _pipeable_ = True
+
+    def stream(self, stdin, *args):
+        try:
+            opts, paths = getopt.getopt(args[1::], 'n:')
+            count = int(dict(opts).get('-n', 10))
+        except (getopt.GetoptError, ValueError) as e:
+            self.terminal.write("tail: {}".format(e))
+            self.terminal.nextLine()
+            return
+
+        if paths:
+            source = OPSSHCommand_cat(self.shell).stream(None, 'cat', *paths)
+        else:
+            source = stdin or []
+
+        lines = collections.deque(maxlen=max(count, 0))
+        for chunk in source:
+            lines.extend(chunk)
+            yield []
+
+        yield list(lines)
+available_commands.append(OPSSHCommand_tail)
+
+
+class OPSSHCommand_grep(OPSSHCommand):
+    _name_ = "grep"
+    _short_description_ = "print lines that match patterns"
+    _description_ = """
+    grep [-icnr] [-m NUM] PATTERN [FILE]
+
+    -i      ignore case distinctions
+    -c      print only a count of matching lines per file
+    -n      prefix each line of output with its line number
+    -m NUM  stop reading a file after NUM matching lines
+    -r      read all files under each directory, recursively
+    """
+    _pipeable_ = True
+
+    def prepare(self, *args):
+        # -r lists the files from the path index instead of walking the file system.
+        try:
+            opts, operands = getopt.getopt(args[1::], 'icnrm:')
+        except getopt.GetoptError:
+            return None
+        if '-r' in dict(opts):
+            return self.shell._OctoPrintSSH.path_index.ready()
+        return None
+
+    def stream(self, stdin, *args):
+        try:
+            opts, operands = getopt.getopt(args[1::], 'icnrm:')
+            opts = dict(opts)
+            max_count = int(opts.get('-m', 0))
+        except (getopt.GetoptError, ValueError) as e:
+            self.terminal.write("grep: {}".format(e))
+            self.terminal.nextLine()
+            return
+
+        if not operands:
+            self.help()
+            return
+
+        ignore_case = '-i' in opts
+        count_only = '-c' in opts
+        line_numbers = '-n' in opts
+        recursive = '-r' in opts
+
+        paths = operands[1::]
+        from_stdin = not paths and stdin is not None and not recursive
+
+        try:
+            regex = opsshgrep.compile_pattern(operands[0], ignore_case, binary=not from_stdin)
+        except Exception as e:
+            self.terminal.write("grep: {}".format(e))
+            self.terminal.nextLine()
+            return
+
+        if from_stdin:
+            for chunk in self._grep_stdin(stdin, regex, count_only, line_numbers, max_count):
+                yield chunk
+            return
+
+        if not paths:
+            paths = [self.shell.pwd]
+
+        vfs = self.shell._OctoPrintSSH.vfs
+        files = []
+        for path in paths:
+            path = self.abspath(path)
+            if vfs.isdir(path):
+                if recursive:
+                    files.extend(p for p, is_dir in self.shell._OctoPrintSSH.path_index.walk(path) if not is_dir)
+                else:
+                    self.terminal.write("grep: {}: Is a directory".format(path))
+                    self.terminal.nextLine()
+            elif vfs.isfile(path):
+                files.append(path)
             else:
-                try:
-                    with self.shell._OctoPrintSSH.vfs.open(path) as f:
-                        self.terminal.write(f.read())
-                except Exception:
-                    self.terminal.write("cat: {}: No such file".format(path))
+                self.terminal.write("grep: {}: No such file or directory".format(path))
+                self.terminal.nextLine()
+
+        prefix = len(files) > 1 or recursive
+        for path in files:
+            try:
+                f = vfs.openbin(path)
+            except Exception:
+                self.terminal.write("grep: {}: Unable to open file".format(path))
+                self.terminal.nextLine()
+                continue
+
+            count = 0
+            with f:
+                for matches in opsshgrep.grep_file(f, regex, line_numbers, max_count):
+                    count += len(matches)
+                    if count_only:
+                        yield []
+                    else:
+                        yield [self._format(path if prefix else None, lineno if line_numbers else None, line.decode('utf-8', 'replace')) for lineno, line in matches]
+
+            if count_only:
+                yield [self._format(path if prefix else None, None, str(count))]
+
+    def _grep_stdin(self, stdin, regex, count_only, line_numbers, max_count):
+        count = 0
+        lineno = 0
+        for chunk in stdin:
+            lines = []
+            for line in chunk:
+                lineno += 1
+                if regex.search(line):
+                    count += 1
+                    if not count_only:
+                        lines.append(self._format(None, lineno if line_numbers else None, line))
+                    if max_count and count >= max_count:
+                        break
+            yield lines
+            if max_count and count >= max_count:
+                break
+
+        if count_only:
+            yield [str(count)]
+
+    def _format(self, path, lineno, line):
+        if lineno is not None:
+            line = "{}:{}".format(lineno, line)
+        if path is not None:
+            line = "{}:{}".format(path, line)
+        return line
+available_commands.append(OPSSHCommand_grep)
+
+
+class OPSSHCommand_find(OPSSHCommand):
+    _name_ = "find"
+    _short_description_ = "search for files in a directory hierarchy"
+    _description_ = """
+    find [PATH] [-name PATTERN] [-iname PATTERN] [-type f|d]
+    """
+    _pipeable_ = True
+
+    def prepare(self, *args):
+        return self.shell._OctoPrintSSH.path_index.ready()
+
+    def stream(self, stdin, *args):
+        paths = []
+        name = None
+        ignore_case = False
+        type = None
+
+        args = list(args[1::])
+        while args:
+            arg = args.pop(0)
+            if arg in ('-name', '-iname', '-type'):
+                if not args:
+                    self.terminal.write("find: missing argument to `{}'".format(arg))
                     self.terminal.nextLine()
-available_commands.append(OPSSHCommand_cat)
+                    return
+                value = args.pop(0)
+                if arg == '-type':
+                    if value not in ('f', 'd'):
+                        self.terminal.write("find: Unknown argument to -type: {}".format(value))
+                        self.terminal.nextLine()
+                        return
+                    type = value
+                else:
+                    name = value
+                    ignore_case = arg == '-iname'
+            elif arg.startswith('-'):
+                self.terminal.write("find: unknown predicate `{}'".format(arg))
+                self.terminal.nextLine()
+                return
+            else:
+                paths.append(arg)
+
+        if not paths:
+            paths = [self.shell.pwd]
+
+        if name is not None:
+            if ignore_case:
+                name = name.lower()
+            pattern = re.compile(fnmatch.translate(name))
+
+        index = self.shell._OctoPrintSSH.path_index
+        for path in paths:
+            entries = index.walk(self.abspath(path))
+            if not entries:
+                self.terminal.write("find: '{}': No such file or directory".format(path))
+                self.terminal.nextLine()
+                continue
+
+            lines = []
+            for p, is_dir in entries:
+                if type is not None and (type == 'd') != is_dir:
+                    continue
+                if name is not None:
+                    basename = p.rsplit('/', 1)[-1] or '/'
+                    if not pattern.match(basename.lower() if ignore_case else basename):
+                        continue
+                lines.append(p)
+                if len(lines) >= 1000:
+                    yield lines
+                    lines = []
+            yield lines
+available_commands.append(OPSSHCommand_find)
+
+
+class OPSSHCommand_sha256sum(OPSSHCommand):
+    _name_ = "sha256sum"
+    _short_description_ = "Print SHA256 checksums of files."
+    _description_ = """
+    sha256sum [FILE...]
+
+    Files are hashed in parallel on worker threads. Checksums are remembered
+    until the size or modification time of a file changes.
+    """
+    algorithm = 'sha256'
+
+    def main(self, *args):
+        if len(args) < 2:
+            self.help()
+            return
+
+        workers = max(1, self.shell._OctoPrintSSH._settings.get_int(["hash_workers"]))
+        semaphore = defer.DeferredSemaphore(workers)
+        self._cancelled = False
+        self._results = [None] * (len(args) - 1)
+        self._shown = 0
+
+        pending = []
+        for i, path in enumerate(args[1::]):
+            d = semaphore.run(self._hash, self.abspath(path))
+            d.addErrback(self._failed, path)
+            d.addCallback(self._hashed, i)
+            pending.append(d)
+
+        if self._shown == len(self._results):
+            return
+
+        defer.DeferredList(pending).addCallback(self._finished)
+        return self
+
+    def _hash(self, path):
+        if self._cancelled:
+            return None
+
+        vfs = self.shell._OctoPrintSSH.vfs
+        if not vfs.isfile(path):
+            return "{}: {}: No such file".format(self._name_, path)
+
+        cache = self.shell._OctoPrintSSH.metadata_cache
+        syspath = vfs.getsyspath(path)
+        key = cache.key(syspath, self.algorithm)
+
+        digest = cache.get(key)
+        if digest is not None:
+            return "{}  {}".format(digest, path)
+
+        d = threads.deferToThread(hash_file, syspath, self.algorithm, abort=lambda: self._cancelled)
+        d.addCallback(self._cache, key, path)
+        return d
+
+    def _cache(self, digest, key, path):
+        self.shell._OctoPrintSSH.metadata_cache.set(key, digest)
+        return "{}  {}".format(digest, path)
+
+    def _failed(self, failure, path):
+        if failure.check(OPSSHHashAborted):
+            return None
+        return "{}: {}: Unable to read file".format(self._name_, path)
+
+    def _hashed(self, line, i):
+        if self._cancelled:
+            return
+
+        # Checksums are printed in argument order, whichever finishes first.
+        self._results[i] = line
+        while self._shown < len(self._results) and self._results[self._shown] is not None:
+            self.terminal.write(self._results[self._shown])
+            self.terminal.nextLine()
+            self._shown += 1
+
+    def _finished(self, results):
+        if not self._cancelled:
+            self.shell.commandFinished(self)
+
+    def term(self):
+        self._cancelled = True
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_sha256sum)
+
+
+class OPSSHCommand_md5sum(OPSSHCommand_sha256sum):
+    _name_ = "md5sum"
+    _short_description_ = "Print MD5 checksums of files."
+    _description_ = """
+    md5sum [FILE...]
+
+    Files are hashed in parallel on worker threads. Checksums are remembered
+    until the size or modification time of a file changes.
+    """
+    algorithm = 'md5'
+available_commands.append(OPSSHCommand_md5sum)
+
+
+class OPSSHCommand_du(OPSSHCommand):
+    _name_ = "du"
+    _short_description_ = "estimate file space usage"
+    _description_ = """
+    du [-ash] [PATH...]
+
+    -a  show files as well as directories
+    -s  only show a total for each PATH
+    -h  print sizes in human readable format
+    """
+    _pipeable_ = True
+
+    def prepare(self, *args):
+        return self.shell._OctoPrintSSH.path_index.ready()
+
+    def stream(self, stdin, *args):
+        try:
+            opts, paths = getopt.getopt(args[1::], 'ash')
+        except getopt.GetoptError as e:
+            self.terminal.write("du: {}".format(e))
+            self.terminal.nextLine()
+            return
+        opts = dict(opts)
+
+        if not paths:
+            paths = [self.shell.pwd]
+
+        index = self.shell._OctoPrintSSH.path_index
+        for path in paths:
+            path = self.abspath(path)
+            if '-s' in opts:
+                size = index.size(path)
+                entries = [(path, size)] if size is not None else []
+            else:
+                entries = index.usage(path, '-a' in opts)
+
+            if not entries:
+                self.terminal.write("du: cannot access '{}': No such file or directory".format(path))
+                self.terminal.nextLine()
+                continue
+
+            lines = []
+            for p, size in entries:
+                lines.append("{}\t{}".format(format_size(size) if '-h' in opts else (size + 1023) // 1024, p))
+                if len(lines) >= 1000:
+                    yield lines
+                    lines = []
+            yield lines
+available_commands.append(OPSSHCommand_du)
+
+
+class OPSSHCommand_df(OPSSHCommand):
+    _name_ = "df"
+    _short_description_ = "report file system disk space usage"
+    _description_ = """
+    df [-h]
+    """
+
+    def main(self, *args):
+        human = '-h' in args[1::]
+        vfs = self.shell._OctoPrintSSH.vfs
+
+        rows = [("Filesystem", "Size" if human else "1K-blocks", "Used", "Avail", "Use%", "Mounted on")]
+        for name in self.shell._OctoPrintSSH.path_index.mounts():
+            try:
+                syspath = vfs.getsyspath('/' + name)
+                usage = shutil.disk_usage(syspath)
+            except Exception:
+                self.terminal.write("df: /{}: Unable to read file system".format(name))
+                self.terminal.nextLine()
+                continue
+
+            values = (usage.total, usage.used, usage.free)
+            if human:
+                values = [format_size(v) for v in values]
+            else:
+                values = [v // 1024 for v in values]
+            percent = "{}%".format(int(math.ceil(100.0 * usage.used / (usage.used + usage.free)))) if usage.total else '-'
+            rows.append((syspath,) + tuple(values) + (percent, '/' + name))
+
+        width = max(len(row[0]) for row in rows)
+        for row in rows:
+            self.terminal.write("{:<{}} {:>10} {:>10} {:>10} {:>5} {}".format(row[0], width, *row[1::]))
+            self.terminal.nextLine()
+available_commands.append(OPSSHCommand_df)
 
 
 class OPSSHCommand_terminal(OPSSHCommand):
     _name_ = "terminal"
     _short_description_ = "Enter the OctoPrint terminal interface."
     _description_ = ""
+    # Above this rate, or while the client is not draining its output, the log is drawn
+    # as whole screens at most every frame_interval instead of line by line.
+    max_line_rate = 100
+    resume_line_rate = 50
+    max_pending = 64 * 1024
+    frame_interval = 0.1
 
     def __init__(self, protocol):
         self.ps = '>'
+        self._frames = False
+        self._frame_call = None
+        self._recent = collections.deque()
+        self._undrawn = 0
+        self._skipped = 0
+        self._rate = 0
+        self._rate_count = 0
+        self._rate_start = time.time()
         super(OPSSHCommand_terminal, self).__init__(protocol)
 
     def main(self, *args):
@@ -287,32 +1119,36 @@ class OPSSHCommand_terminal(OPSSHCommand):
         self.terminal.write("Entering terminal mode. Press CTRL+C to exit.")
         self.terminal.nextLine()
         self.showPrompt()
-        self.terminal.write(''.join(self.shell.lineBuffer))
+        self.terminal.write(b''.join(self.shell.lineBuffer).decode())
 
         with self.shell._OctoPrintSSH._terminal_cbs_mutex:
-            self.shell._OctoPrintSSH._terminal_cbs[self.shell.avatar.conn.transport.transport.sessionno] = self._write_printer_log
+            self.shell._OctoPrintSSH._terminal_cbs[('terminal', self.shell.session.id)] = self._write_printer_log
 
         return self
 
     def term(self):
+        if self._frame_call and self._frame_call.active():
+            self._frame_call.cancel()
+        self._frame_call = None
+
         self.shell.lineBuffer = []
         self.shell.lineBufferIndex = 0
         self.terminal.eraseLine()
-        self.terminal.cursorPos.y = self.shell.avatar.windowSize[0] - 1
+        self.terminal.cursorPos.y = self.shell.windowSize[0] - 1
         self.terminal.cursorPos.x = 0
         self.terminal.cursorPosition(self.terminal.cursorPos.x, self.terminal.cursorPos.y)
         with self.shell._OctoPrintSSH._terminal_cbs_mutex:
             try:
-                self.shell._OctoPrintSSH._terminal_cbs.pop(self.shell.avatar.conn.transport.transport.sessionno, None)
+                self.shell._OctoPrintSSH._terminal_cbs.pop(('terminal', self.shell.session.id), None)
             except:
                 pass
 
     def handle_CTRL_L(self):
         self.terminal.reset()
-        self.terminal.cursorPos.y = self.shell.avatar.windowSize[0] - 1
+        self.terminal.cursorPos.y = self.shell.windowSize[0] - 1
         self.terminal.cursorPosition(self.terminal.cursorPos.x, self.terminal.cursorPos.y)
         self.showPrompt()
-        self.terminal.write(''.join(self.shell.lineBuffer))
+        self.terminal.write(b''.join(self.shell.lineBuffer).decode())
 
     def handle_CTRL_U(self):
         self.shell.lineBuffer = []
@@ -343,24 +1179,305 @@ class OPSSHCommand_terminal(OPSSHCommand):
 
     def showPrompt(self):
         self.terminal.saveCursor()
-        self.terminal.cursorPos.y = self.shell.avatar.windowSize[0] - 1
+        self.terminal.cursorPos.y = self.shell.windowSize[0] - 1
         self.terminal.cursorPosition(self.terminal.cursorPos.x, self.terminal.cursorPos.y)
         self.terminal.write("{} ".format(self.ps))
 
+    def _rows(self):
+        return self.shell.windowSize[0] or 24
+
+    def _measure(self):
+        now = time.time()
+        if now - self._rate_start >= 1:
+            self._rate = self._rate_count / (now - self._rate_start)
+            self._rate_count = 0
+            self._rate_start = now
+
     def _write_printer_log(self, line):
+        self._rate_count += 1
+        self._measure()
+
+        if not self._frames and (self._rate > self.max_line_rate or self.shell.outputPending() > self.max_pending):
+            self._frames = True
+            self._recent = collections.deque(maxlen=max(1, self._rows() - 2))
+            self._undrawn = 0
+            self._skipped = 0
+            self._frame_call = reactor.callLater(self.frame_interval, self._render_frame)
+
+        if self._frames:
+            self._recent.append(line)
+            self._undrawn += 1
+            return
+
         self.terminal.eraseLine()
         self.terminal.nextLine()
         self.terminal.cursorUp()
         self.terminal.write(line)
         self.terminal.nextLine()
-        self.terminal.write('> ' + ''.join(self.shell.lineBuffer))
+        self.terminal.write('> ' + b''.join(self.shell.lineBuffer).decode())
+
+    def _render_frame(self):
+        self._frame_call = None
+        try:
+            if not self._draw_frame():
+                self._frames = False
+                return
+        except Exception:
+            self.shell._OctoPrintSSH._logger.exception("Error while drawing terminal frame")
+
+        self._frame_call = reactor.callLater(self.frame_interval, self._render_frame)
+
+    def _draw_frame(self):
+        # Returns whether frame mode goes on.
+        self._measure()
+
+        # Lines that scrolled out of the buffer before ever being drawn.
+        self._skipped += max(0, self._undrawn - len(self._recent))
+        self._undrawn = min(self._undrawn, len(self._recent))
+
+        if self.shell.outputPending() > self.max_pending:
+            return True
+
+        rows = self._rows()
+        cols = self.shell.windowSize[1] or 80
+        lines = list(self._recent)
+        if self._skipped:
+            lines = ["-- skipped {} lines --".format(self._skipped)] + lines
+        lines = lines[-(rows - 1):]
+        lines = [''] * (rows - 1 - len(lines)) + lines
+
+        prompt = '> ' + b''.join(self.shell.lineBuffer).decode()
+        frame = ''.join('\x1b[{};1H\x1b[2K{}'.format(y + 1, l[:cols]) for y, l in enumerate(lines))
+        self.terminal.write(frame + '\x1b[{};1H\x1b[2K{}'.format(rows, prompt))
+        self.terminal.cursorPos.x = len(prompt)
+        self.terminal.cursorPos.y = rows - 1
+
+        self._undrawn = 0
+        self._skipped = 0
+
+        return self._rate >= self.resume_line_rate or self.shell.outputPending() > self.max_pending
 available_commands.append(OPSSHCommand_terminal)
 
 
+class OPSSHCommand_send(OPSSHCommand):
+    _name_ = "send"
+    _short_description_ = "Stream a gcode file to the printer."
+    _description_ = """
+    send [FILE]
+
+    Lines are sent in batches while keeping at most a limited number of
+    commands unacknowledged by the printer. Press CTRL+C to stop.
+
+    Acknowledgements are matched to the Send/Recv lines of the printer log in
+    order, which is an approximation if a plugin rewrites commands before they
+    are sent. @-commands and blocked or ignored commands are not waited for.
+    send stops with an error if no acknowledgement arrives within the
+    configured timeout. Refused while a print job is running.
+    """
+    progress_interval = 0.25
+
+    def main(self, *args):
+        if not Permissions.CONTROL in self.shell.user.effective_permissions:
+            self.terminal.write("Access denied.")
+            self.terminal.nextLine()
+            return
+
+        if len(args) != 2:
+            self.help()
+            return
+
+        path = self.abspath(args[1])
+        if not self.shell._OctoPrintSSH.vfs.isfile(path):
+            self.terminal.write("send: {}: No such file".format(path))
+            self.terminal.nextLine()
+            return
+
+        if not self.shell._OctoPrintSSH._printer.is_operational():
+            self.terminal.write("send: printer is not operational")
+            self.terminal.nextLine()
+            return
+
+        if self.shell._OctoPrintSSH._printer.is_printing() or self.shell._OctoPrintSSH._printer.is_paused():
+            self.terminal.write("send: a print job is running")
+            self.terminal.nextLine()
+            return
+
+        try:
+            self._file = self.shell._OctoPrintSSH.vfs.openbin(path)
+            self._size = self.shell._OctoPrintSSH.vfs.getsize(path)
+        except Exception:
+            self.terminal.write("send: {}: Unable to open file".format(path))
+            self.terminal.nextLine()
+            return
+
+        self._chunks = read_lines(self._file)
+        self._pending = collections.deque()
+        self._window = max(1, self.shell._OctoPrintSSH._settings.get_int(["send_window"]))
+        self._sent = 0
+        self._acked = 0
+        self._eof = False
+        self._last_progress = 0
+        self._key = ('send', self.shell.session.id)
+        settings = self.shell._OctoPrintSSH._settings
+        self._acks = OPSSHAckMatcher((settings.global_get(["serial", "blockedCommands"]) or []) + (settings.global_get(["serial", "ignoredCommands"]) or []))
+        self._ack_timeout = max(0, self.shell._OctoPrintSSH._settings.get_int(["send_ack_timeout"]))
+        self._watchdog = None
+
+        with self.shell._OctoPrintSSH._terminal_cbs_mutex:
+            self.shell._OctoPrintSSH._terminal_cbs[self._key] = self._on_printer_log
+
+        self._fill()
+        if self._file is None:
+            return
+        return self
+
+    def _next_lines(self, count):
+        lines = []
+        while len(lines) < count:
+            if not self._pending:
+                if self._eof:
+                    break
+                try:
+                    self._pending.extend(next(self._chunks))
+                except StopIteration:
+                    self._eof = True
+                    continue
+
+            line = self._pending.popleft().split(';', 1)[0].strip()
+            if line:
+                lines.append(line)
+        return lines
+
+    def _fill(self):
+        inflight = self._sent - self._acked
+        if inflight < self._window:
+            lines = self._next_lines(self._window - inflight)
+            if lines:
+                settled = self._acks.queue(lines)
+                self.shell._OctoPrintSSH._printer.commands(lines)
+                self._sent += len(lines)
+                self._acked += settled
+                if self._watchdog is None:
+                    self._arm()
+
+        if self._eof and not self._pending and self._acked >= self._sent:
+            self._close()
+            self.terminal.write("\rsend: {} lines sent".format(self._sent))
+            self.terminal.eraseToLineEnd()
+            self.terminal.nextLine()
+            self.shell.commandFinished(self)
+            return
+
+        now = time.time()
+        if now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            position = self._file.tell() if self._size else 0
+            self.terminal.write("\rsend: {} lines sent, {} in flight, {:.0f}%".format(self._sent, self._sent - self._acked, 100.0 * position / self._size if self._size else 100))
+            self.terminal.eraseToLineEnd()
+
+    def _on_printer_log(self, line):
+        if self._file is None:
+            return
+
+        settled = self._acks.feed(line)
+        if settled:
+            self._acked = min(self._sent, self._acked + settled)
+            self._arm()
+            self._fill()
+
+    def _arm(self):
+        if self._watchdog is not None and self._watchdog.active():
+            self._watchdog.cancel()
+        self._watchdog = None
+        if self._ack_timeout and self._acked < self._sent:
+            self._watchdog = reactor.callLater(self._ack_timeout, self._stalled)
+
+    def _stalled(self):
+        self._watchdog = None
+        if self._file is None:
+            return
+
+        self._close()
+        self.terminal.write("\rsend: no acknowledgement from the printer for {}s, stopped after {} lines".format(self._ack_timeout, self._sent))
+        self.terminal.eraseToLineEnd()
+        self.terminal.nextLine()
+        self.shell.commandFinished(self)
+
+    def _close(self):
+        if self._watchdog is not None and self._watchdog.active():
+            self._watchdog.cancel()
+        self._watchdog = None
+        with self.shell._OctoPrintSSH._terminal_cbs_mutex:
+            self.shell._OctoPrintSSH._terminal_cbs.pop(self._key, None)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._chunks.close()
+
+    def term(self):
+        if self._file is not None:
+            self._close()
+            self.terminal.write("\rsend: cancelled after {} lines".format(self._sent))
+            self.terminal.eraseToLineEnd()
+            self.terminal.nextLine()
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_send)
+
+
+class OPSSHCommand_events(OPSSHCommand):
+    _name_ = "events"
+    _short_description_ = "Stream OctoPrint events as JSON lines."
+    _description_ = """
+    events [EVENT...]
+
+    EVENT may contain shell style wildcards. All events are streamed when
+    none are given. File events need the file list permission, user and
+    client events are only streamed to administrators. Press CTRL+C to stop.
+    """
+
+    def main(self, *args):
+        if not Permissions.STATUS in self.shell.user.effective_permissions:
+            self.terminal.write("Access denied.")
+            self.terminal.nextLine()
+            return
+
+        self.buffer = OPSSHLineBuffer(self._write)
+        self.channel = self.shell.ssh_session.channel
+        self.channel.producer = self.buffer
+        self.subscription = self.shell._OctoPrintSSH.event_hub.subscribe(args[1::], self.buffer.append, lambda: self.shell.user.effective_permissions)
+        return self
+
+    def _write(self, lines):
+        self.terminal.write('\n'.join(lines) + '\n')
+
+    def term(self):
+        self.shell._OctoPrintSSH.event_hub.unsubscribe(self.subscription)
+        self.channel.producer = None
+        self.buffer.close()
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_events)
+
+
 class OPSSHCommand_status(OPSSHCommand):
     _name_ = "status"
     _short_description_ = "Displays the current OctoPrint status information."
-    _description_ = ""
+    _description_ = """
+    status [-w] [-j]
+
+    -w  keep the view open and update it whenever the printer state changes
+    -j  print the status as JSON, one line per update with -w
+    """
+    max_pending = 64 * 1024
 
     def main(self, *args):
         if not Permissions.STATUS in self.shell.user.effective_permissions:
@@ -368,40 +1485,53 @@ class OPSSHCommand_status(OPSSHCommand):
             self.terminal.nextLine()
             return
 
+        try:
+            opts, rest = getopt.getopt(args[1::], 'wj')
+        except getopt.GetoptError as e:
+            self.terminal.write("status: {}".format(e))
+            self.terminal.nextLine()
+            return
+        opts = dict(opts)
+        format = 'json' if '-j' in opts else 'text'
+
+        broadcast = self.shell._OctoPrintSSH.status
         data = self.shell._OctoPrintSSH._printer.get_current_data()
 
-        self.terminal.write("State: {}".format(data['state']['text']))
-        self.terminal.nextLine()
+        if '-w' not in opts:
+            if format == 'json':
+                self.terminal.write(render_status(data, format).decode('utf-8').rstrip())
+                self.terminal.nextLine()
+                return
 
-        self.terminal.write("File: {}".format(data['job']['file']['name']))
-        self.terminal.nextLine()
+            for line in status_lines(data):
+                self.terminal.write(line)
+                self.terminal.nextLine()
 
-        if data['progress']['printTime']:
-            progress_printTime = data['progress']['printTime']
-        else:
-            progress_printTime = '-'
-        self.terminal.write("Print Time: {}".format(progress_printTime))
-        self.terminal.nextLine()
+            self.terminal.nextLine()
+            return
 
-        if data['progress']['printTimeLeft']:
-            progres_printTimeLeft = data['progress']['printTimeLeft']
-        else:
-            progres_printTimeLeft = '-'
-        self.terminal.write("Print Time Left: {}".format(progres_printTimeLeft))
-        self.terminal.nextLine()
+        self._write(render_status(data, format, self._width()))
+        self.subscription = broadcast.subscribe(format, self._width, self._write)
+        return self
 
-        if data['progress']['filepos']:
-            progress_filepos = data['progress']['filepos']
-        else:
-            progress_filepos = '-'
-        if data['job']['file']['size']:
-            job_file_filepos = data['job']['file']['size']
-        else:
-            job_file_filepos = '-'
-        self.terminal.write("Printed: {} / {}".format(progress_filepos, job_file_filepos))
-        self.terminal.nextLine()
+    def _width(self):
+        return self.shell.windowSize[1]
+
+    def _write(self, frame):
+        # A frame supersedes the previous one, so it is dropped while the client is behind.
+        if self.shell.outputPending() > self.max_pending:
+            return
+        self.terminal.transport.write(frame)
 
+    def term(self):
+        self.shell._OctoPrintSSH.status.unsubscribe(self.subscription)
         self.terminal.nextLine()
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
 available_commands.append(OPSSHCommand_status)
 
 
@@ -434,17 +1564,25 @@ class OPSSHCommand_print(OPSSHCommand):
         if path[0] != '/':
             path = os.path.join(self.shell.pwd, path)
 
-        if not self.shell._OctoPrintSSH.vfs.isfile(path):
+        return self.after_index(self._print, path, args[1])
+
+    def _print(self, path, name):
+        if not self.shell._OctoPrintSSH.path_index.isfile(path):
             self.terminal.write("print: {}: No such file".format(path))
             self.terminal.nextLine()
             return
 
+        if not is_printable(self.shell._OctoPrintSSH.path_index, path):
+            self.terminal.write("print: {}: Not a printable file".format(path))
+            self.terminal.nextLine()
+            return
+
 
         data = self.shell._OctoPrintSSH._printer.get_current_data()
 
         #TODO: Reevaluate the logic here.
         if data['state']['flags']['printing'] or data['state']['flags']['paused']:
-            self.terminal.write("Already printing.")
+            self.terminal.write("Already printing. Use `queue add {}` to print it next.".format(name))
             self.terminal.nextLine()
             return
 
@@ -453,9 +1591,209 @@ class OPSSHCommand_print(OPSSHCommand):
         except Exception:
             self.terminal.write("Error printing.")
             self.terminal.nextLine()
+
+    def term(self):
+        self._index_wait = None
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
 available_commands.append(OPSSHCommand_print)
 
 
+class OPSSHCommand_info(OPSSHCommand):
+    _name_ = "info"
+    _short_description_ = "Display print estimates for a gcode file."
+    _description_ = """
+    info [FILE]
+    """
+
+    def main(self, *args):
+        if len(args) != 2:
+            self.help()
+            return
+
+        path = self.abspath(args[1])
+        vfs = self.shell._OctoPrintSSH.vfs
+        if not vfs.isfile(path):
+            self.terminal.write("info: {}: No such file".format(path))
+            self.terminal.nextLine()
+            return
+
+        cache = self.shell._OctoPrintSSH.metadata_cache
+        try:
+            syspath = vfs.getsyspath(path)
+            key = cache.key(syspath)
+        except Exception:
+            self.terminal.write("info: {}: Unable to read file".format(path))
+            self.terminal.nextLine()
+            return
+
+        result = cache.get(key)
+        if result is None:
+            analysis = self._octoprint_analysis(path)
+            if analysis:
+                result = ("OctoPrint", analysis)
+                cache.set(key, result)
+
+        if result is not None:
+            self._show(path, key, result)
+            return
+
+        self.terminal.write("Analyzing {}...".format(path))
+        self.terminal.nextLine()
+        self._cancelled = False
+        d = threads.deferToThread(self._analyze, syspath)
+        d.addCallbacks(self._analyzed, self._failed, callbackArgs=(path, key))
+        return self
+
+    def _octoprint_analysis(self, path):
+        if not path.startswith('/uploads/'):
+            return None
+
+        try:
+            metadata = self.shell._OctoPrintSSH._file_manager.get_metadata(FileDestinations.LOCAL, path[len('/uploads/'):])
+        except Exception:
+            return None
+
+        analysis = (metadata or {}).get('analysis')
+        if analysis and not analysis.get('_empty') and 'estimatedPrintTime' in analysis:
+            return analysis
+        return None
+
+    def _analyze(self, syspath):
+        with open(syspath, 'rb') as f:
+            return analyze_gcode(f, abort=lambda: self._cancelled)
+
+    def _analyzed(self, analysis, path, key):
+        if self._cancelled:
+            return
+        result = ("SSH Interface", analysis)
+        self.shell._OctoPrintSSH.metadata_cache.set(key, result)
+        self._show(path, key, result)
+        self.shell.commandFinished(self)
+
+    def _failed(self, failure):
+        if self._cancelled or failure.check(OPSSHAnalysisAborted):
+            return
+        self.shell._OctoPrintSSH._logger.error("Error while analyzing file: {}".format(failure.getErrorMessage()))
+        self.terminal.write("info: analysis failed")
+        self.terminal.nextLine()
+        self.shell.commandFinished(self)
+
+    def _show(self, path, key, result):
+        source, analysis = result
+
+        self.terminal.write("File: {}".format(path))
+        self.terminal.nextLine()
+        self.terminal.write("Size: {}".format(format_size(key[1])))
+        self.terminal.nextLine()
+        self.terminal.write("Analysis: {}".format(source))
+        self.terminal.nextLine()
+        self.terminal.write("Estimated Print Time: {}".format(format_duration(analysis.get('estimatedPrintTime'))))
+        self.terminal.nextLine()
+
+        for tool, filament in sorted((analysis.get('filament') or {}).items()):
+            self.terminal.write("Filament ({}): {:.2f}m / {:.2f}cm³".format(tool, (filament.get('length') or 0) / 1000.0, filament.get('volume') or 0))
+            self.terminal.nextLine()
+
+        dimensions = analysis.get('dimensions')
+        if dimensions:
+            self.terminal.write("Dimensions: {:.1f} x {:.1f} x {:.1f} mm".format(dimensions['width'], dimensions['depth'], dimensions['height']))
+            self.terminal.nextLine()
+
+        area = analysis.get('printingArea')
+        if area:
+            self.terminal.write("Printing Area: X {:.1f}..{:.1f}  Y {:.1f}..{:.1f}  Z {:.1f}..{:.1f}".format(area['minX'], area['maxX'], area['minY'], area['maxY'], area['minZ'], area['maxZ']))
+            self.terminal.nextLine()
+
+    def term(self):
+        self._cancelled = True
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_info)
+
+
+class OPSSHCommand_queue(OPSSHCommand):
+    _name_ = "queue"
+    _short_description_ = "Manage the print job queue."
+    _description_ = """
+    queue add [FILE]
+    queue ls
+    queue rm [N]
+    queue clear
+
+    Only gcode files below /uploads can be queued. The next queued job is
+    started when the current print finishes.
+    """
+
+    def main(self, *args):
+        if not Permissions.PRINT in self.shell.user.effective_permissions:
+            self.terminal.write("Access denied.")
+            self.terminal.nextLine()
+            return
+
+        queue = self.shell._OctoPrintSSH.print_queue
+        action = args[1] if len(args) > 1 else 'ls'
+
+        if action == 'add' and len(args) > 2:
+            return self.after_index(self._add, [self.abspath(path) for path in args[2::]])
+        elif action == 'ls' and len(args) <= 2:
+            jobs = queue.list()
+            if not jobs:
+                self.terminal.write("Queue is empty.")
+                self.terminal.nextLine()
+            for n, job in enumerate(jobs, 1):
+                self.terminal.write("{: >3}  {}  {}  {}".format(n, time.strftime("%Y-%m-%d %H:%M", time.localtime(job['added'])), job['user'], job['path']))
+                self.terminal.nextLine()
+        elif action == 'rm' and len(args) == 3:
+            try:
+                job = queue.remove(int(args[2]) - 1)
+            except ValueError:
+                job = None
+            if job is None:
+                self.terminal.write("queue: {}: No such job".format(args[2]))
+            else:
+                self.terminal.write("Removed {}".format(job['path']))
+            self.terminal.nextLine()
+        elif action == 'clear' and len(args) == 2:
+            self.terminal.write("Removed {} job(s)".format(queue.clear()))
+            self.terminal.nextLine()
+        else:
+            self.help()
+
+    def _add(self, paths):
+        index = self.shell._OctoPrintSSH.path_index
+        for path in paths:
+            if not index.isfile(path):
+                self.terminal.write("queue: {}: No such file".format(path))
+                self.terminal.nextLine()
+                continue
+            if not is_printable(index, path):
+                self.terminal.write("queue: {}: Not a printable file".format(path))
+                self.terminal.nextLine()
+                continue
+            position = self.shell._OctoPrintSSH.print_queue.add(index.normpath(path), self.shell.session.user)
+            self.terminal.write("{}: {}".format(position, path))
+            self.terminal.nextLine()
+
+    def term(self):
+        self._index_wait = None
+
+    def lineReceived(self, line):
+        pass
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
+available_commands.append(OPSSHCommand_queue)
+
+
 class OPSSHCommand_cancel(OPSSHCommand):
     _name_ = "cancel"
     _short_description_ = "Cancels running print job."
@@ -0,0 +1,158 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+from octoprint.access.permissions import Permissions
+from twisted.conch.error import ConchError
+from twisted.conch.ssh import channel, connection, forwarding
+from twisted.internet import protocol, reactor
+from twisted.internet.endpoints import HostnameEndpoint, connectProtocol
+
+LOCALHOST = ('localhost', '127.0.0.1', '::1')
+
+
+def parse_ports(value):
+    ports = set()
+    for port in str(value or '').replace(',', ' ').split():
+        try:
+            port = int(port)
+        except ValueError:
+            continue
+        if 0 < port < 65536:
+            ports.add(port)
+    return ports
+
+
+def open_forward_channel(remoteWindow, remoteMaxPacket, data, avatar):
+    (host, port), (origin_host, origin_port) = forwarding.unpackOpen_direct_tcpip(data)
+    plugin = avatar.conn.transport._OctoPrintSSH
+
+    # The webcam streamer is usually unauthenticated, so forwarding needs the webcam permission.
+    # OctoPrint may trust connections from localhost as a local login (autologinLocal), so its
+    # own HTTP port is reserved for administrators.
+    allowed = parse_ports(plugin._settings.get(["forward_ports"]))
+    user = avatar.user
+    required = Permissions.ADMIN if port == plugin.http_port else Permissions.WEBCAM
+    if host not in LOCALHOST or port not in allowed or not user.is_active or required not in user.effective_permissions:
+        plugin._logger.info("Refused forwarding for {} to {} port {}".format(avatar.name, host, port))
+        raise ConchError("Forwarding to {}:{} is not allowed".format(host, port), connection.OPEN_ADMINISTRATIVELY_PROHIBITED)
+
+    return OPSSHForwardChannel(host, port, remoteWindow=remoteWindow, remoteMaxPacket=remoteMaxPacket, avatar=avatar)
+
+
+class OPSSHForwardClient(protocol.Protocol):
+    def __init__(self, channel):
+        self.channel = channel
+
+    def connectionMade(self):
+        # Read more per wakeup than the 64K default, the channel splits it into packets.
+        self.transport.bufferSize = self.channel.read_size
+        self.transport.registerProducer(self.channel, True)
+
+    def dataReceived(self, data):
+        self.channel.write(data)
+
+    def connectionLost(self, reason):
+        if self.channel:
+            self.channel.client = None
+            self.channel.loseConnection()
+            self.channel = None
+
+
+class OPSSHForwardChannel(channel.SSHChannel):
+    # Both directions are flow controlled. The socket stops being read while the SSH
+    # client's window is used up, and the SSH client's window is not refilled while
+    # the socket can not keep up.
+    name = b'direct-tcpip'
+    window_size = 2 * 1024 * 1024
+    max_packet = 32 * 1024
+    read_size = 256 * 1024
+
+    def __init__(self, host, port, *args, **kw):
+        kw.setdefault('localWindow', self.window_size)
+        kw.setdefault('localMaxPacket', self.max_packet)
+        channel.SSHChannel.__init__(self, *args, **kw)
+        self.host = host
+        self.port = port
+        self.client = None
+        self.pending = []
+        self.eof = False
+        self.entry = None
+
+    def channelOpen(self, specificData):
+        self.entry = self.avatar.conn.transport._OctoPrintSSH.sessions.register_forward(self)
+        # Anything sent before the socket connects is held, at most one window.
+        self.pauseProducing()
+        d = connectProtocol(HostnameEndpoint(reactor, self.host, self.port), OPSSHForwardClient(self))
+        d.addCallbacks(self._connected, self._failed)
+
+    def _connected(self, client):
+        if self.closing or self.localClosed:
+            client.transport.loseConnection()
+            return
+
+        self.client = client
+        if self.pending:
+            client.transport.writeSequence(self.pending)
+            self.pending = []
+        if self.eof:
+            client.transport.loseWriteConnection()
+        self.resumeProducing()
+
+    def _failed(self, reason):
+        self.avatar.conn.transport._OctoPrintSSH._logger.info("Unable to forward to {} port {}: {}".format(self.host, self.port, reason.getErrorMessage()))
+        self.loseConnection()
+
+    def write(self, data):
+        if self.entry:
+            self.entry.bytes_sent += len(data)
+            self.entry.touch()
+        channel.SSHChannel.write(self, data)
+
+    def dataReceived(self, data):
+        if self.entry:
+            self.entry.touch()
+        if self.client:
+            self.client.transport.write(data)
+        else:
+            self.pending.append(data)
+
+    def eofReceived(self):
+        self.eof = True
+        if self.client:
+            self.client.transport.loseWriteConnection()
+
+    def closed(self):
+        if self.entry:
+            self.avatar.conn.transport._OctoPrintSSH.sessions.unregister(self.entry)
+            self.entry = None
+        if self.client:
+            client = self.client
+            self.client = None
+            client.channel = None
+            client.transport.unregisterProducer()
+            client.transport.loseConnection()
+
+    def stopWriting(self):
+        if self.client:
+            self.client.transport.pauseProducing()
+
+    def startWriting(self):
+        if self.client:
+            self.client.transport.resumeProducing()
+
+    def pauseProducing(self):
+        # SSHConnection refills the window while localWindowLeft is below half of
+        # localWindowSize, a size of 0 holds it back.
+        self.localWindowSize = 0
+
+    def resumeProducing(self):
+        self.localWindowSize = self.window_size
+        if self.localWindowLeft < self.localWindowSize // 2:
+            self.conn.adjustWindow(self, self.localWindowSize - self.localWindowLeft)
+
+    def stopProducing(self):
+        self.loseConnection()
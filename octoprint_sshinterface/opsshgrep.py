@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import re
+
+CHUNK_SIZE = 1024 * 1024
+DENSE_MATCHES = 256
+
+
+def compile_pattern(pattern, ignore_case=False, binary=True):
+    flags = re.MULTILINE
+    if ignore_case:
+        flags |= re.IGNORECASE
+    if binary:
+        pattern = pattern.encode('utf-8')
+    return re.compile(pattern, flags)
+
+
+def scan(buf, end, regex, lineno=1, line_numbers=False, max_count=0):
+    # Searches buf[:end], which must end on a line boundary, for matching lines.
+    # Returns the matches as (lineno, line) tuples and the line number following end.
+    matches = []
+    pos = 0
+    counted = 0
+
+    while pos < end:
+        m = regex.search(buf, pos, end)
+        if m is None or m.start() >= end:
+            break
+
+        start = buf.rfind(b'\n', 0, m.start()) + 1
+        stop = buf.find(b'\n', m.start(), end)
+        if stop == -1:
+            stop = end
+
+        # A match running past the end of its line only counts if the line matches on its own.
+        if m.end() > stop and regex.search(buf, start, stop) is None:
+            pos = stop + 1
+            continue
+
+        if line_numbers:
+            lineno += buf.count(b'\n', counted, start)
+            counted = start
+
+        matches.append((lineno, buf[start:stop].rstrip(b'\r')))
+        pos = stop + 1
+
+        if max_count and len(matches) >= max_count:
+            break
+
+    if line_numbers:
+        lineno += buf.count(b'\n', counted, end)
+
+    return matches, lineno
+
+
+def scan_lines(buf, end, regex, lineno=1, max_count=0):
+    # Line by line variant of scan(), cheaper once most lines match.
+    matches = []
+    search = regex.search
+    lines = buf[:end].split(b'\n')
+    if buf[end - 1:end] == b'\n':
+        lines.pop()
+
+    for n, line in enumerate(lines, lineno):
+        if search(line):
+            matches.append((n, line.rstrip(b'\r')))
+            if max_count and len(matches) >= max_count:
+                break
+
+    return matches, lineno + len(lines)
+
+
+def grep_file(f, regex, line_numbers=False, max_count=0, chunk_size=CHUNK_SIZE):
+    # Yields a list of (lineno, line) matches for every chunk read from the binary file f.
+    # Lines crossing a chunk boundary are carried over into the next chunk.
+    carry = b''
+    lineno = 1
+    found = 0
+    dense = False
+
+    while True:
+        data = f.read(chunk_size)
+        if data:
+            buf = carry + data if carry else data
+            end = buf.rfind(b'\n') + 1
+        else:
+            buf = carry
+            end = len(buf)
+
+        if end:
+            remaining = max_count - found if max_count else 0
+            if dense:
+                matches, lineno = scan_lines(buf, end, regex, lineno, remaining)
+            else:
+                matches, lineno = scan(buf, end, regex, lineno, line_numbers, remaining)
+            dense = len(matches) * 256 > end and len(matches) > DENSE_MATCHES
+            found += len(matches)
+            yield matches
+        else:
+            yield []
+
+        carry = buf[end:]
+
+        if not data or (max_count and found >= max_count):
+            break
@@ -0,0 +1,29 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import hashlib
+
+# hashlib drops the GIL for updates larger than 2047 bytes, so large chunks let workers hash in parallel.
+CHUNK_SIZE = 1024 * 1024
+
+
+class OPSSHHashAborted(Exception):
+    pass
+
+
+def hash_file(syspath, algorithm, abort=None, chunk_size=CHUNK_SIZE):
+    h = hashlib.new(algorithm)
+    with open(syspath, 'rb') as f:
+        while True:
+            if abort and abort():
+                raise OPSSHHashAborted()
+
+            data = f.read(chunk_size)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
@@ -0,0 +1,331 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import bisect
+import posixpath
+import threading
+import time
+from octoprint.events import Events
+from twisted.internet import defer, threads
+
+
+def prefix_range(items, prefix):
+    start = bisect.bisect_left(items, prefix)
+    end = start
+    while end < len(items) and items[end].startswith(prefix):
+        end += 1
+    return start, end
+
+
+def complete(items, prefix):
+    start, end = prefix_range(items, prefix)
+    return items[start:end]
+
+
+class OPSSHMountIndex(object):
+    def __init__(self, name, live):
+        self.name = name
+        self.root = '/' + name
+        self.live = live
+        self.paths = []
+        self.dirs = set()
+        # File sizes and, for directories, the total size of everything below them.
+        self.sizes = {}
+        self.built = None
+        # Set while a scan runs on a worker thread, changes reported meanwhile are replayed on its result.
+        self.building = None
+        self.pending = []
+        self.waiters = []
+        self.generation = 0
+
+    def scan(self, vfs):
+        paths = [self.root]
+        dirs = set([self.root])
+        sizes = {self.root: 0}
+        for step in vfs.walk.walk(self.root, namespaces=['details']):
+            for info in step.dirs:
+                path = posixpath.join(step.path, info.name)
+                paths.append(path)
+                dirs.add(path)
+                sizes.setdefault(path, 0)
+            for info in step.files:
+                path = posixpath.join(step.path, info.name)
+                paths.append(path)
+                sizes[path] = info.size or 0
+                self._propagate(sizes, path, sizes[path])
+        paths.sort()
+        return paths, dirs, sizes
+
+    def _propagate(self, sizes, path, delta):
+        while path != self.root:
+            path = posixpath.dirname(path)
+            sizes[path] = sizes.get(path, 0) + delta
+
+    def add(self, path, is_dir=False, size=0):
+        parent = posixpath.dirname(path)
+        if parent != path and parent not in self.dirs and parent.startswith(self.root):
+            self.add(parent, True)
+
+        i = bisect.bisect_left(self.paths, path)
+        if i == len(self.paths) or self.paths[i] != path:
+            self.paths.insert(i, path)
+        if is_dir:
+            self.dirs.add(path)
+            self.sizes.setdefault(path, 0)
+        else:
+            delta = size - self.sizes.get(path, 0)
+            self.sizes[path] = size
+            if delta:
+                self._propagate(self.sizes, path, delta)
+
+    def remove(self, path):
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            del self.paths[i]
+
+        size = self.sizes.pop(path, 0)
+        if size:
+            self._propagate(self.sizes, path, -size)
+
+        if path in self.dirs:
+            self.dirs.discard(path)
+            start, end = prefix_range(self.paths, path + '/')
+            for p in self.paths[start:end]:
+                self.dirs.discard(p)
+                self.sizes.pop(p, None)
+            del self.paths[start:end]
+
+
+class OPSSHPathIndex(object):
+    refresh_interval = 30
+
+    def __init__(self, vfs, live_mounts, mounts, logger):
+        self.vfs = vfs
+        self._logger = logger
+        self._mutex = threading.Lock()
+        self._mounts = {}
+        for name in mounts:
+            self._mounts[name] = OPSSHMountIndex(name, name in live_mounts)
+
+    def _mount(self, path):
+        name = path.lstrip('/').split('/', 1)[0]
+        return self._mounts.get(name)
+
+    def _ensure(self, mount):
+        # Answers from the current snapshot, empty until the first scan finished.
+        # Must be called on the reactor thread with _mutex held.
+        if mount.building is None and (mount.built is None or (not mount.live and time.time() - mount.built > self.refresh_interval)):
+            mount.building = threads.deferToThread(mount.scan, self.vfs)
+            mount.building.addCallbacks(self._built, self._failed, callbackArgs=(mount, mount.generation), errbackArgs=(mount,))
+        return mount
+
+    def _built(self, result, mount, generation):
+        with self._mutex:
+            mount.paths, mount.dirs, mount.sizes = result
+            for path, is_dir, size in mount.pending:
+                if size is None:
+                    mount.remove(path)
+                else:
+                    mount.add(path, is_dir, size)
+            mount.pending = []
+            mount.building = None
+            mount.built = time.time() if generation == mount.generation else None
+            waiters, mount.waiters = mount.waiters, []
+
+        for d in waiters:
+            d.callback(None)
+
+    def _failed(self, failure, mount):
+        self._logger.error("Unable to index {}: {}".format(mount.root, failure.getErrorMessage()))
+        with self._mutex:
+            mount.pending = []
+            mount.building = None
+            waiters, mount.waiters = mount.waiters, []
+
+        for d in waiters:
+            d.errback(failure)
+
+    def ready(self):
+        # Returns a Deferred that fires once every mount without a current snapshot has been scanned.
+        waiting = []
+        with self._mutex:
+            for mount in self._mounts.values():
+                if mount.built is None:
+                    self._ensure(mount)
+                    d = defer.Deferred()
+                    mount.waiters.append(d)
+                    waiting.append(d)
+
+        if not waiting:
+            return defer.succeed(None)
+        return defer.gatherResults(waiting, consumeErrors=True)
+
+    def mounts(self):
+        return sorted(self._mounts)
+
+    def invalidate(self, name=None):
+        with self._mutex:
+            for mount in self._mounts.values():
+                if name is None or mount.name == name:
+                    mount.built = None
+                    mount.generation += 1
+
+    def isdir(self, path):
+        path = self.normpath(path)
+        if path == '/':
+            return True
+
+        with self._mutex:
+            mount = self._mount(path)
+            return mount is not None and path in self._ensure(mount).dirs
+
+    def isfile(self, path):
+        path = self.normpath(path)
+        with self._mutex:
+            mount = self._mount(path)
+            if mount is None:
+                return False
+            self._ensure(mount)
+            i = bisect.bisect_left(mount.paths, path)
+            return i < len(mount.paths) and mount.paths[i] == path and path not in mount.dirs
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def children(self, path, prefix=''):
+        # Returns (name, is_dir) tuples for the entries of directory path whose name starts with prefix.
+        path = self.normpath(path)
+        if path == '/':
+            return [(name, True) for name in sorted(self._mounts) if name.startswith(prefix)]
+
+        with self._mutex:
+            mount = self._mount(path)
+            if mount is None:
+                return []
+            self._ensure(mount)
+
+            base = path.rstrip('/') + '/'
+            result = []
+            i, end = prefix_range(mount.paths, base + prefix)
+            while i < end:
+                name = mount.paths[i][len(base):]
+                if '/' in name:
+                    # Skip the whole subtree; '0' sorts directly after '/'.
+                    i = bisect.bisect_left(mount.paths, base + name.split('/', 1)[0] + '0', i, end)
+                    continue
+                result.append((name, mount.paths[i] in mount.dirs))
+                i += 1
+            return result
+
+    def walk(self, path):
+        # Returns (path, is_dir) tuples for path and everything below it, sorted.
+        path = self.normpath(path)
+        if path == '/':
+            result = [('/', True)]
+            for name in sorted(self._mounts):
+                result.extend(self.walk('/' + name))
+            return result
+
+        with self._mutex:
+            mount = self._mount(path)
+            if mount is None:
+                return []
+            self._ensure(mount)
+
+            i = bisect.bisect_left(mount.paths, path)
+            if i == len(mount.paths) or mount.paths[i] != path:
+                return []
+
+            result = [(path, path in mount.dirs)]
+            if path in mount.dirs:
+                result.extend((p, p in mount.dirs) for p in complete(mount.paths, path + '/'))
+            return result
+
+    def size(self, path):
+        # Returns the size of a file or the total size below a directory, None if path does not exist.
+        path = self.normpath(path)
+        if path == '/':
+            sizes = [self.size('/' + name) for name in self._mounts]
+            return sum(size for size in sizes if size)
+
+        with self._mutex:
+            mount = self._mount(path)
+            if mount is None:
+                return None
+            return self._ensure(mount).sizes.get(path)
+
+    def usage(self, path, files=False):
+        # Returns (path, size) tuples for path and the directories below it, children before their parent.
+        path = self.normpath(path)
+        if path == '/':
+            result = []
+            for name in sorted(self._mounts):
+                result.extend(self.usage('/' + name, files))
+            result.append(('/', self.size('/')))
+            return result
+
+        with self._mutex:
+            mount = self._mount(path)
+            if mount is None:
+                return []
+            self._ensure(mount)
+
+            if path not in mount.sizes:
+                return []
+
+            result = []
+            if path in mount.dirs:
+                # Sorted by component, a plain sort puts 'a-v2' and 'a.b' between 'a' and 'a/x'.
+                stack = []
+                for p in sorted(complete(mount.paths, path + '/'), key=lambda p: p.split('/')):
+                    while stack and not p.startswith(stack[-1] + '/'):
+                        d = stack.pop()
+                        result.append((d, mount.sizes.get(d, 0)))
+                    if p in mount.dirs:
+                        stack.append(p)
+                    elif files:
+                        result.append((p, mount.sizes.get(p, 0)))
+                while stack:
+                    d = stack.pop()
+                    result.append((d, mount.sizes.get(d, 0)))
+            result.append((path, mount.sizes[path]))
+            return result
+
+    def on_event(self, event, payload):
+        if event not in (Events.FILE_ADDED, Events.FILE_REMOVED, Events.FOLDER_ADDED, Events.FOLDER_REMOVED):
+            return
+
+        if not payload or payload.get('storage') != 'local':
+            return
+
+        mount = self._mounts.get('uploads')
+        if mount is None:
+            return
+
+        path = self.normpath(posixpath.join(mount.root, payload['path']))
+        size = 0
+        if event == Events.FILE_ADDED:
+            try:
+                size = self.vfs.getinfo(path, namespaces=['details']).size or 0
+            except Exception:
+                pass
+
+        with self._mutex:
+            if mount.building is not None:
+                mount.pending.append((path, event == Events.FOLDER_ADDED, size if event in (Events.FILE_ADDED, Events.FOLDER_ADDED) else None))
+
+            if mount.built is None:
+                return
+
+            if event in (Events.FILE_ADDED, Events.FOLDER_ADDED):
+                mount.add(path, event == Events.FOLDER_ADDED, size)
+            else:
+                mount.remove(path)
+
+    @staticmethod
+    def normpath(path):
+        return posixpath.normpath('/' + path.lstrip('/'))
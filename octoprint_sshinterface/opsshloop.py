@@ -0,0 +1,104 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import sys
+import threading
+
+REACTORS = ['default', 'asyncio']
+
+
+def install_reactor(name):
+    # Has to happen before anything imports twisted.internet.reactor.
+    if 'twisted.internet.reactor' in sys.modules:
+        return False
+
+    if name == 'asyncio':
+        import asyncio
+        from twisted.internet import asyncioreactor
+        asyncioreactor.install(asyncio.SelectorEventLoop())
+        return True
+
+    return False
+
+
+class OPSSHEventLoop(object):
+    def __init__(self, logger):
+        self._logger = logger
+        self._thread = None
+        self._pending = collections.deque()
+        self._scheduled = False
+        self._mutex = threading.Lock()
+
+    @property
+    def reactor(self):
+        from twisted.internet import reactor
+        return reactor
+
+    @property
+    def name(self):
+        return type(self.reactor).__name__
+
+    @property
+    def ident(self):
+        return self._thread.ident if self._thread is not None else None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, started=None):
+        if self.running:
+            return
+
+        if started:
+            self.reactor.callWhenRunning(started)
+
+        self._thread = threading.Thread(target=self._run, name="SSHInterface")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self._logger.info("Starting {}".format(self.name))
+        self.reactor.run(installSignalHandlers=0)
+
+    def stop(self, timeout=5):
+        if not self.running:
+            return
+
+        self.reactor.callFromThread(self.reactor.stop)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._logger.warning("Reactor thread did not stop within {} seconds".format(timeout))
+        self._thread = None
+
+    def call_blocking(self, f, *args, **kwargs):
+        # Runs f on the reactor thread and waits for its result, including a Deferred it returns.
+        from twisted.internet import threads
+        return threads.blockingCallFromThread(self.reactor, f, *args, **kwargs)
+
+    def call_from_thread(self, f, *args, **kwargs):
+        # Calls queued while the reactor has not picked up the previous batch share one wakeup.
+        with self._mutex:
+            self._pending.append((f, args, kwargs))
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        self.reactor.callFromThread(self._drain)
+
+    def _drain(self):
+        with self._mutex:
+            pending = self._pending
+            self._pending = collections.deque()
+            self._scheduled = False
+
+        for f, args, kwargs in pending:
+            try:
+                f(*args, **kwargs)
+            except Exception:
+                self._logger.exception("Error while processing {}".format(getattr(f, '__name__', f)))
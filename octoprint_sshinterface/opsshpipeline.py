@@ -0,0 +1,164 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import shlex
+import time
+from twisted.internet import defer, reactor
+
+CHUNK_SIZE = 64 * 1024
+
+
+def split_pipeline(line):
+    stages = []
+    current = []
+    quote = None
+    escape = False
+
+    for ch in line:
+        if escape:
+            escape = False
+        elif ch == '\\' and quote != "'":
+            escape = True
+        elif quote:
+            if ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '|':
+            stages.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    stages.append(''.join(current))
+
+    return [shlex.split(stage) for stage in stages]
+
+
+def read_lines(f, chunk_size=CHUNK_SIZE):
+    # Yields lists of decoded lines, one list per chunk read from a binary file object.
+    carry = b''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+
+        data = carry + data
+        end = data.rfind(b'\n') + 1
+        carry = data[end:]
+        yield [l.decode('utf-8', 'replace') for l in data[:end].splitlines()]
+
+    if carry:
+        yield [l.decode('utf-8', 'replace') for l in carry.splitlines()]
+
+
+class OPSSHPipeline(object):
+    time_slice = 0.02
+    max_pending = 256 * 1024
+
+    def __init__(self, shell, stages):
+        self.shell = shell
+        self.terminal = shell.terminal
+        self.stages = stages
+        self._streams = []
+        self._call = None
+        self._preparing = None
+
+    def start(self):
+        waiting = [d for d in (command.prepare(*args) for command, args in self.stages) if d is not None]
+        if not waiting:
+            self._begin()
+            return
+
+        self._preparing = defer.gatherResults(waiting, consumeErrors=True)
+        self._preparing.addCallbacks(self._prepared, self._prepareFailed)
+
+    def _prepared(self, result):
+        if self._preparing is None:
+            return
+        self._preparing = None
+        self._begin()
+
+    def _prepareFailed(self, failure):
+        if self._preparing is None:
+            return
+        self._preparing = None
+        self.terminal.write("An unknown error occurred.")
+        self.terminal.nextLine()
+        self._finish()
+
+    def _begin(self):
+        stream = None
+        for command, args in self.stages:
+            stream = iter(command.stream(stream, *args))
+            self._streams.append(stream)
+        self._call = reactor.callLater(0, self._pump)
+
+    def _pump(self):
+        self._call = None
+        deadline = time.time() + self.time_slice
+        stream = self._streams[-1]
+
+        try:
+            while time.time() < deadline:
+                if self.shell.outputPending() > self.max_pending:
+                    self._call = reactor.callLater(0.05, self._pump)
+                    return
+
+                chunk = next(stream)
+                if chunk:
+                    self.terminal.write('\n'.join(chunk) + '\n')
+        except StopIteration:
+            self._finish()
+            return
+        except Exception:
+            self.shell._OctoPrintSSH._logger.exception("Exception while running pipeline `{}`.".format(self.shell.session.command))
+            self.terminal.write("An unknown error occurred.")
+            self.terminal.nextLine()
+            self._finish()
+            return
+
+        self._call = reactor.callLater(0, self._pump)
+
+    def _close(self):
+        self._preparing = None
+        if self._call and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        for stream in reversed(self._streams):
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+        self._streams = []
+
+    def _finish(self):
+        self._close()
+        self.shell.commandFinished(self)
+
+    def term(self):
+        self._close()
+
+    def handle_CTRL_C(self):
+        raise NotImplementedError()
+
+    def handle_CTRL_D(self):
+        raise NotImplementedError()
+
+    def handle_CTRL_L(self):
+        raise NotImplementedError()
+
+    def handle_CTRL_U(self):
+        raise NotImplementedError()
+
+    def lineReceived(self, line):
+        pass
+
+    def keystrokeReceived(self, keyID, modifier):
+        raise NotImplementedError()
+
+    def characterReceived(self, ch, moreCharactersComing):
+        pass
@@ -0,0 +1,89 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import os
+import sys
+import threading
+import time
+
+MAX_DEPTH = 128
+
+
+class OPSSHSamplingProfiler(object):
+    # Samples the stack of one thread from a separate thread. Nothing is hooked into the sampled thread.
+    def __init__(self, ident, interval=0.005):
+        self.ident = ident
+        self.interval = interval
+        self.started = None
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._labels = {}
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="SSHInterface profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            stack = ';'.join(stack)
+
+            with self._mutex:
+                self._stacks[stack] += 1
+                self.samples += 1
+
+    def _label(self, code):
+        try:
+            return self._labels[code]
+        except KeyError:
+            label = self._labels[code] = "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            return label
+
+    def top(self, count=10):
+        # Returns the functions most often found on top of the stack as (label, samples) tuples.
+        functions = collections.Counter()
+        with self._mutex:
+            for stack, samples in self._stacks.items():
+                functions[stack.rsplit(';', 1)[-1]] += samples
+        return functions.most_common(count)
+
+    def dump(self, path):
+        # Writes collapsed stacks, one "frame;frame;frame count" line per stack, as used by flamegraph.pl and speedscope.
+        with self._mutex:
+            stacks = sorted(self._stacks.items())
+        with open(path, 'w') as f:
+            for stack, samples in stacks:
+                f.write("{} {}\n".format(stack, samples))
+        return len(stacks)
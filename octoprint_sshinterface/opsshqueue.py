@@ -0,0 +1,145 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import json
+import threading
+import time
+from octoprint.filemanager import valid_file_type
+from twisted.internet import reactor, threads
+from .opsshstorage import atomic_write
+
+
+def is_printable(index, path):
+    # Only machine code below /uploads may be printed, never logs or scripts.
+    # Looked up in the path index, which must have a snapshot, on the reactor thread.
+    path = index.normpath(path)
+    return path.startswith('/uploads/') and valid_file_type(path, type="machinecode") and index.isfile(path)
+
+
+class OPSSHPrintQueue(object):
+    retry_delay = 1
+    max_retry_delay = 60
+
+    def __init__(self, plugin, path):
+        self._OctoPrintSSH = plugin
+        self.path = path
+        self._mutex = threading.Lock()
+        self._write_mutex = threading.Lock()
+        self._version = 0
+        self._saved = 0
+        self._flushing = None
+        self._retry = None
+        self._retry_delay = self.retry_delay
+        self.jobs = []
+
+        try:
+            with open(self.path, 'rb') as f:
+                self.jobs = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError):
+            pass
+        except ValueError:
+            self._OctoPrintSSH._logger.error("Unable to parse print queue {}. Starting with an empty queue.".format(self.path))
+
+    def _save(self):
+        # Called with _mutex held, the file is written behind on a worker thread.
+        self._version += 1
+        self._OctoPrintSSH.loop.call_from_thread(self._flush_later)
+
+    def _flush_later(self):
+        if self._flushing is not None or self._saved == self._version:
+            return
+
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        self._retry = None
+
+        self._flushing = threads.deferToThread(self._write)
+        self._flushing.addCallbacks(self._flushed, self._flush_failed)
+
+    def _flushed(self, result):
+        self._flushing = None
+        self._retry_delay = self.retry_delay
+        self._flush_later()
+
+    def _flush_failed(self, failure):
+        # Retried on the next change or after a growing delay, whichever comes first.
+        self._flushing = None
+        self._OctoPrintSSH._logger.error("Unable to save print queue, retrying in {}s: {}".format(self._retry_delay, failure.getErrorMessage()))
+        self._retry = reactor.callLater(self._retry_delay, self._flush_later)
+        self._retry_delay = min(self._retry_delay * 2, self.max_retry_delay)
+
+    def _write(self):
+        with self._write_mutex:
+            with self._mutex:
+                if self._saved == self._version:
+                    return
+                data = json.dumps(self.jobs).encode('utf-8')
+                version = self._version
+
+            atomic_write(self.path, data)
+
+            with self._mutex:
+                self._saved = version
+
+    def flush(self):
+        try:
+            self._write()
+        except (IOError, OSError) as e:
+            self._OctoPrintSSH._logger.error("Unable to save print queue: {}".format(e))
+
+    def list(self):
+        with self._mutex:
+            return list(self.jobs)
+
+    def add(self, path, user):
+        with self._mutex:
+            self.jobs.append(dict(path=path, user=user, added=time.time()))
+            self._save()
+            return len(self.jobs)
+
+    def remove(self, index):
+        with self._mutex:
+            if index < 0 or index >= len(self.jobs):
+                return None
+            job = self.jobs.pop(index)
+            self._save()
+            return job
+
+    def clear(self):
+        with self._mutex:
+            count = len(self.jobs)
+            self.jobs = []
+            self._save()
+            return count
+
+    def start_next(self):
+        # Called on the reactor thread, jobs are checked once the path index has a snapshot.
+        d = self._OctoPrintSSH.path_index.ready()
+        d.addCallback(lambda result: self._start_next())
+        d.addErrback(lambda failure: self._OctoPrintSSH._logger.error("Unable to start the next queued job: {}".format(failure.getErrorMessage())))
+
+    def _start_next(self):
+        plugin = self._OctoPrintSSH
+        while True:
+            with self._mutex:
+                if not self.jobs:
+                    return None
+                job = self.jobs.pop(0)
+                self._save()
+
+            if not is_printable(plugin.path_index, job['path']):
+                plugin._logger.warning("Skipping queued job {}: file no longer exists or is not printable".format(job['path']))
+                continue
+
+            try:
+                plugin._printer.select_file(plugin.vfs.getsyspath(job['path']), False, printAfterSelect=True)
+            except Exception:
+                plugin._logger.exception("Unable to start queued job {}".format(job['path']))
+                continue
+
+            plugin._logger.info("Started queued job {} added by {}".format(job['path'], job['user']))
+            return job
@@ -0,0 +1,274 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import json
+import os
+import struct
+import threading
+import time
+from twisted.internet import defer, reactor, task, threads
+
+# Every record is a 13 byte header followed by its payload:
+#   kind (B), session id (I), milliseconds since session start (I), payload length (I)
+# A session starts with a START record carrying its metadata as JSON, records of
+# other kinds are attributed to the most recent START with the same session id.
+RECORD = struct.Struct('>BIII')
+RESIZE = struct.Struct('>HH')
+START, INPUT, OUTPUT, RESIZED, END = range(5)
+FILENAME = 'sessions.rec'
+
+
+class OPSSHRecording(object):
+    def __init__(self, recorder, entry, windowSize):
+        self.recorder = recorder
+        self.id = entry.id
+        self.started = time.time()
+        self.closed = False
+        self.paused = False
+        meta = dict(id=entry.id, user=entry.user, peer=entry.peer, started=self.started,
+                    rows=windowSize[0], cols=windowSize[1])
+        self._record(START, json.dumps(meta).encode())
+
+    def _record(self, kind, data):
+        if self.closed:
+            return
+        offset = int((time.time() - self.started) * 1000) & 0xffffffff
+        self.recorder.append(RECORD.pack(kind, self.id, offset, len(data)) + data)
+
+    def input(self, data):
+        self._record(INPUT, data)
+
+    def output(self, data):
+        # Paused while the session plays back a recording itself.
+        if not self.paused:
+            self._record(OUTPUT, data)
+
+    def resize(self, rows, cols):
+        self._record(RESIZED, RESIZE.pack(rows, cols))
+
+    def close(self):
+        self._record(END, b'')
+        self.closed = True
+        self.recorder.recordings.discard(self)
+
+
+class OPSSHSessionRecorder(object):
+    # Records are only appended to memory on the reactor thread, all file IO happens in the thread pool.
+    flush_interval = 1
+    flush_size = 256 * 1024
+
+    def __init__(self, plugin, path):
+        self._OctoPrintSSH = plugin
+        self.path = path
+        self.recordings = set()
+        self._pending = []
+        self._pending_size = 0
+        self._mutex = threading.Lock()
+        # Held while writing and rotating, and while readers open the files.
+        self._files_mutex = threading.Lock()
+        self._loop = None
+        self._flushing = None
+        self._scheduled = False
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @property
+    def enabled(self):
+        return self._OctoPrintSSH._settings.get_boolean(["recording"])
+
+    @property
+    def max_size(self):
+        return max(1, self._OctoPrintSSH._settings.get_int(["recording_max_size"])) * 1024 * 1024
+
+    @property
+    def backups(self):
+        return max(0, self._OctoPrintSSH._settings.get_int(["recording_backups"]))
+
+    def start(self):
+        self._loop = task.LoopingCall(self._flush_later)
+        self._loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        # Ends open recordings and returns a Deferred that fires once everything is on disk.
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+        for recording in list(self.recordings):
+            recording.close()
+
+        d = self._idle()
+        d.addCallback(lambda result: threads.deferToThread(self.flush))
+        return d
+
+    def open(self, entry, windowSize):
+        recording = OPSSHRecording(self, entry, windowSize)
+        self.recordings.add(recording)
+        return recording
+
+    def files(self):
+        # Oldest first.
+        base = os.path.join(self.path, FILENAME)
+        files = ["{}.{}".format(base, i) for i in range(self.backups, 0, -1)] + [base]
+        return [f for f in files if os.path.isfile(f)]
+
+    def append(self, record):
+        with self._mutex:
+            self._pending.append(record)
+            self._pending_size += len(record)
+            if self._pending_size < self.flush_size or self._scheduled:
+                return
+            self._scheduled = True
+        reactor.callLater(0, self._flush_later)
+
+    def _flush_later(self):
+        self._scheduled = False
+        if self._loop is None or self._flushing is not None or not self._pending:
+            return
+
+        self._flushing = threads.deferToThread(self.flush)
+        self._flushing.addBoth(self._flushed)
+
+    def _flushed(self, result):
+        self._flushing = None
+
+    def _idle(self):
+        if self._flushing is None:
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        self._flushing.addBoth(lambda result: d.callback(None))
+        return d
+
+    def flush(self):
+        with self._mutex:
+            pending = self._pending
+            self._pending = []
+            self._pending_size = 0
+
+        if not pending:
+            return
+
+        base = os.path.join(self.path, FILENAME)
+        try:
+            with self._files_mutex:
+                with open(base, 'ab') as f:
+                    f.write(b''.join(pending))
+                    size = f.tell()
+                if size >= self.max_size:
+                    self._rotate(base)
+        except (IOError, OSError) as e:
+            self._OctoPrintSSH._logger.error("Unable to write session recording: {}".format(e))
+
+    def _rotate(self, base):
+        backups = self.backups
+        if not backups:
+            os.remove(base)
+            return
+
+        for i in range(backups - 1, 0, -1):
+            src = "{}.{}".format(base, i)
+            if os.path.isfile(src):
+                os.replace(src, "{}.{}".format(base, i + 1))
+        os.replace(base, "{}.1".format(base))
+
+    def _open(self):
+        # Opens the files oldest first as (file, key) tuples without a rotation in between.
+        # The key identifies a file across rotations, which only rename it.
+        opened = []
+        with self._files_mutex:
+            for path in self.files():
+                try:
+                    f = open(path, 'rb')
+                except (IOError, OSError):
+                    continue
+                st = os.fstat(f.fileno())
+                opened.append((f, (st.st_dev, st.st_ino)))
+        return opened
+
+    def index(self):
+        return threads.deferToThread(self._index)
+
+    def _index(self):
+        # Returns recordings oldest first as dicts with their metadata and the byte ranges
+        # of the files holding their records. Only START payloads are read.
+        recordings = []
+        current = {}
+        for f, key in self._open():
+            with f:
+                pos = 0
+                while True:
+                    header = f.read(RECORD.size)
+                    if len(header) < RECORD.size:
+                        break
+                    kind, id, offset, length = RECORD.unpack(header)
+
+                    if kind == START:
+                        try:
+                            meta = json.loads(f.read(length).decode())
+                        except ValueError:
+                            meta = {}
+                        recording = current[id] = dict(meta, id=id, segments=[], size=0, duration=0, ended=False)
+                        recordings.append(recording)
+                    else:
+                        f.seek(length, os.SEEK_CUR)
+                        recording = current.get(id)
+                        if recording is None:
+                            # Its START was rotated away.
+                            recording = current[id] = dict(id=id, segments=[], size=0, duration=0, ended=False)
+                            recordings.append(recording)
+                        recording['duration'] = max(recording['duration'], offset)
+                        recording['size'] += length
+                        if kind == END:
+                            recording['ended'] = True
+                            del current[id]
+
+                    end = pos + RECORD.size + length
+                    segments = recording['segments']
+                    if segments and segments[-1][0] == key:
+                        segments[-1][2] = end
+                    else:
+                        segments.append([key, pos, end])
+                    pos = end
+        return recordings
+
+    def events(self, recording, kinds=(OUTPUT,)):
+        return threads.deferToThread(self._events, recording, kinds)
+
+    def _events(self, recording, kinds):
+        # Walks the byte ranges found by index() record by record and returns (kind, offset, payload)
+        # tuples. Payloads of other sessions and other kinds are skipped without being read.
+        events = []
+        opened = self._open()
+        try:
+            files = dict((key, f) for f, key in opened)
+            for key, start, end in recording['segments']:
+                f = files.get(key)
+                if f is None:
+                    # Rotated away since index().
+                    continue
+
+                f.seek(start)
+                pos = start
+                while pos + RECORD.size <= end:
+                    header = f.read(RECORD.size)
+                    if len(header) < RECORD.size:
+                        break
+                    kind, id, offset, length = RECORD.unpack(header)
+                    pos += RECORD.size + length
+                    if id == recording['id'] and kind in kinds:
+                        payload = f.read(length)
+                        if len(payload) < length:
+                            break
+                        events.append((kind, offset, payload))
+                    else:
+                        f.seek(length, os.SEEK_CUR)
+        finally:
+            for f, key in opened:
+                f.close()
+        return events
@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import re
+import collections
+
+
+class OPSSHAckMatcher(object):
+    # Pairs the Send/Recv lines of the printer log with the commands queued by send.
+    # @-commands and blocked or ignored commands are never logged as sent, so they settle
+    # when queued. Commands dropped by a hook settle once a later one of ours is sent.
+    sent_line = re.compile(r'^Send: (?:N\d+\s+)?(.*?)(?:\*\d+)?$')
+    gcode = re.compile(r'^(?:N\d+\s+)?([A-Z]\d+)')
+    # Sent by OctoPrint on its own, so they never prove that an earlier command was dropped.
+    polled = ('M105', 'M27')
+
+    def __init__(self, skipped=()):
+        self.skipped = set(code.upper() for code in skipped)
+        self._expected = collections.deque()
+        self._outstanding = collections.deque()
+
+    def normalize(self, line):
+        return ' '.join(line.split()).upper()
+
+    def queue(self, lines):
+        # Returns how many of the lines handed to OctoPrint settle right away.
+        settled = 0
+        for line in lines:
+            command = self.normalize(line)
+            code = self.gcode.match(command)
+            if command.startswith('@') or (code and code.group(1) in self.skipped):
+                settled += 1
+            else:
+                self._expected.append(command)
+        return settled
+
+    def feed(self, line):
+        # Returns how many queued commands the printer log line settled.
+        if line.startswith("Send: "):
+            match = self.sent_line.match(line)
+            command = self.normalize(match.group(1) if match else line[6:])
+            try:
+                index = self._expected.index(command)
+            except ValueError:
+                index = -1
+
+            if index > 0 and command.split(' ', 1)[0] in self.polled:
+                index = -1
+
+            if index < 0:
+                self._outstanding.append(False)
+                return 0
+
+            # Everything queued before this command was never sent and gets no ok.
+            for _ in range(index + 1):
+                self._expected.popleft()
+            self._outstanding.append(True)
+            return index
+        elif line.startswith("Recv: ok") and self._outstanding:
+            return 1 if self._outstanding.popleft() else 0
+        return 0
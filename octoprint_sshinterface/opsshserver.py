@@ -7,7 +7,9 @@ __copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AG
 
 from twisted.conch import avatar, recvline, interfaces
 from twisted.conch.interfaces import IConchUser, ISession
-from twisted.conch.ssh import factory, keys, session, userauth
+from twisted.conch.ssh import connection, factory, keys, session, userauth
+from twisted.conch.ssh.transport import SSHServerTransport, DISCONNECT_BY_APPLICATION, DISCONNECT_TOO_MANY_CONNECTIONS
+from twisted.conch.ssh.userauth import MSG_USERAUTH_REQUEST, MSG_USERAUTH_SUCCESS
 from twisted.conch.insults import insults
 from twisted.cred.error import UnauthorizedLogin, UnhandledCredentials
 from twisted.cred import portal, checkers, credentials
@@ -16,21 +18,164 @@ from twisted.conch.ssh.common import NS, getNS
 from twisted.python import failure, reflect
 from zope.interface import implementer
 from base64 import decodebytes
+from .opsshpipeline import OPSSHPipeline, split_pipeline
+from .opsshindex import complete
+from .opsshforward import open_forward_channel
+import os
 import shlex
+import struct
+import zlib
 
 
 @implementer(portal.IRealm)
 class OPSSHRealm(object):
-    def __init__(self, commands):
+    def __init__(self, commands, exec_commands):
         self.commands = commands
+        self.exec_commands = exec_commands
 
     def requestAvatar(self, avatarId, mind, *interfaces):
         if IConchUser in interfaces:
-            return interfaces[0], OPSSHAvatar(avatarId, self.commands), lambda: None
+            return interfaces[0], OPSSHAvatar(avatarId, self.commands, self.exec_commands), lambda: None
         else:
             raise NotImplementedError("No supported interfaces found.")
 
+class OPSSHServerTransport(SSHServerTransport):
+    compressionLevel = 6
+    authenticated = False
+
+    def connectionLost(self, reason):
+        SSHServerTransport.connectionLost(self, reason)
+        self.factory.connectionClosed(self)
+
+    def sendPacket(self, messageType, payload):
+        queued = self._keyExchangeState != self._KEY_EXCHANGE_NONE and not self._allowedKeyExchangeMessageType(messageType)
+        SSHServerTransport.sendPacket(self, messageType, payload)
+        if messageType == MSG_USERAUTH_SUCCESS and not queued:
+            self.authenticated = True
+            self._startCompression()
+
+    def _newKeys(self):
+        # OpenSSH restarts both compression streams with every NEWKEYS. SSHTransportBase._newKeys
+        # only does so for zlib and at level 6, so the streams are replaced here, before the
+        # packets queued during the key exchange go out.
+        self.currentEncryptions = self.nextEncryptions
+        self.outgoingCompression = self.incomingCompression = None
+        self._startCompression()
+
+        self._keyExchangeState = self._KEY_EXCHANGE_NONE
+        messages = self._blockedByKeyExchange
+        self._blockedByKeyExchange = None
+        for messageType, payload in messages:
+            self.sendPacket(messageType, payload)
+
+    def _compressionActive(self, compressionType):
+        # zlib@openssh.com is delayed until the client has authenticated.
+        return compressionType == b'zlib' or (compressionType == b'zlib@openssh.com' and self.authenticated)
+
+    def _startCompression(self):
+        if not self.outgoingCompression and self._compressionActive(self.outgoingCompressionType):
+            self.outgoingCompression = zlib.compressobj(self.compressionLevel)
+        if not self.incomingCompression and self._compressionActive(self.incomingCompressionType):
+            self.incomingCompression = zlib.decompressobj()
+
+
+class OPSSHFactory(factory.SSHFactory):
+    protocol = OPSSHServerTransport
+
+    def __init__(self, plugin):
+        self._OctoPrintSSH = plugin
+        self.connections = set()
+        self.unauthenticated = set()
+        self.user_connections = {}
+        self.login_timers = {}
+
+    @property
+    def login_grace_time(self):
+        return max(0, self._OctoPrintSSH._settings.get_int(["login_grace_time"]))
+
+    def buildProtocol(self, addr):
+        settings = self._OctoPrintSSH._settings
+
+        max_connections = settings.get_int(["max_connections"])
+        if max_connections and len(self.connections) >= max_connections:
+            self._OctoPrintSSH._logger.info("Refused connection from {} port {}: too many connections".format(addr.host, addr.port))
+            return None
+
+        max_unauthenticated = settings.get_int(["max_unauthenticated"])
+        if max_unauthenticated and len(self.unauthenticated) >= max_unauthenticated:
+            self._OctoPrintSSH._logger.info("Refused connection from {} port {}: too many unauthenticated connections".format(addr.host, addr.port))
+            return None
+
+        t = factory.SSHFactory.buildProtocol(self, addr)
+        if settings.get_boolean(["compression"]):
+            t.supportedCompressions = [b'zlib@openssh.com', b'zlib', b'none']
+            t.compressionLevel = min(9, max(1, settings.get_int(["compression_level"])))
+        else:
+            t.supportedCompressions = [b'none']
+        self.connections.add(t)
+        self.unauthenticated.add(t)
+        if self.login_grace_time:
+            self.login_timers[t] = reactor.callLater(self.login_grace_time, self._loginExpired, t, addr)
+        return t
+
+    def _loginExpired(self, transport, addr):
+        self.login_timers.pop(transport, None)
+        if transport in self.unauthenticated:
+            self._OctoPrintSSH._logger.info("Disconnecting {} port {}: timeout before authentication".format(addr.host, addr.port))
+            transport.sendDisconnect(DISCONNECT_BY_APPLICATION, b"Timeout before authentication")
+
+    def _cancelLoginTimer(self, transport):
+        timer = self.login_timers.pop(transport, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+
+    def canAuthenticate(self, username):
+        max_per_user = self._OctoPrintSSH._settings.get_int(["max_connections_per_user"])
+        return not max_per_user or len(self.user_connections.get(username, ())) < max_per_user
+
+    def connectionAuthenticated(self, transport, username):
+        self.unauthenticated.discard(transport)
+        self._cancelLoginTimer(transport)
+        self.user_connections.setdefault(username, set()).add(transport)
+
+    def disconnectUser(self, username, reason):
+        for transport in list(self.user_connections.get(username, ())):
+            transport.sendDisconnect(DISCONNECT_BY_APPLICATION, reason)
+
+    def connectionClosed(self, transport):
+        self.connections.discard(transport)
+        self.unauthenticated.discard(transport)
+        self._cancelLoginTimer(transport)
+        for username, transports in list(self.user_connections.items()):
+            transports.discard(transport)
+            if not transports:
+                del self.user_connections[username]
+
 class OPSSHUserAuthServer(userauth.SSHUserAuthServer):
+    def serviceStarted(self):
+        # The factory's grace timer covers the whole login, this only replaces the 10 hour default.
+        self.loginTimeout = self.transport.factory.login_grace_time or self.loginTimeout
+        userauth.SSHUserAuthServer.serviceStarted(self)
+
+    def ssh_USERAUTH_REQUEST(self, packet):
+        user = getNS(packet)[0]
+        if not self.transport.factory.canAuthenticate(user):
+            self._refuseUser(user)
+            return
+        return userauth.SSHUserAuthServer.ssh_USERAUTH_REQUEST(self, packet)
+
+    def _cbFinishedAuth(self, result):
+        if not self.transport.factory.canAuthenticate(self.user):
+            self._refuseUser(self.user)
+            return
+        self.transport.factory.connectionAuthenticated(self.transport, self.user)
+        return userauth.SSHUserAuthServer._cbFinishedAuth(self, result)
+
+    def _refuseUser(self, user):
+        peer = self.transport.getPeer()
+        self.transport._OctoPrintSSH._logger.info("Refused {} from {} port {}: too many connections for user".format(user.decode(), peer.address.host, peer.address.port))
+        self.transport.sendDisconnect(DISCONNECT_TOO_MANY_CONNECTIONS, b"Too many connections for user")
+
     def auth_publickey(self, packet):
         hasSig = ord(packet[0:1])
         algName, blob, rest = getNS(packet[1:], 2)
@@ -100,8 +245,7 @@ class OPSSHCredentialChecker(object):
         peer = transport.getPeer()
 
         if self._OctoPrintSSH._user_manager.check_password(username, password):
-            user = self._OctoPrintSSH._user_manager.find_user(username)
-            if user.is_active:
+            if self._OctoPrintSSH.users.get(username, fresh=True).is_active:
                 self._OctoPrintSSH._logger.info("Accepted password for {} from {} port {}".format(username, peer.address.host, peer.address.port))
                 return defer.succeed(credentials.username)
 
@@ -120,8 +264,7 @@ class OPSSHPublicKeyChecker(object):
 
         peer = transport.getPeer()
 
-        user = self._OctoPrintSSH._user_manager.find_user(username)
-        if user.is_active:
+        if self._OctoPrintSSH.users.get(username, fresh=True).is_active:
             authorized_keys = self._OctoPrintSSH._user_manager.get_user_setting(username, ("plugins", "sshinterface", "authorized_keys"))
 
             for line in authorized_keys:
@@ -138,17 +281,34 @@ class OPSSHPublicKeyChecker(object):
         self._OctoPrintSSH._logger.info("Failed publickey for {} from {} port {}".format(username, peer.address.host, peer.address.port))
         return defer.fail(UnauthorizedLogin("Invalid key"))
 
-@implementer(ISession)
 class OPSSHAvatar(avatar.ConchUser):
-    def __init__(self, username, commands):
+    def __init__(self, username, commands, exec_commands):
         avatar.ConchUser.__init__(self)
         self.username = username
+        self.name = username.decode()
         self.commands = commands
+        self.exec_commands = {}
+        for command in exec_commands:
+            self.exec_commands[command._name_] = command
+        self.channelLookup.update({b'session': OPSSHSessionChannel,
+                                   b'direct-tcpip': open_forward_channel})
+
+    @property
+    def user(self):
+        # Resolved once and shared by everything on this connection, replaced when OctoPrint reports a change.
+        return self.conn.transport._OctoPrintSSH.users.get(self.name)
+
+
+@implementer(ISession)
+class OPSSHSession(object):
+    # One per session channel, a connection may multiplex several shells and exec commands.
+    def __init__(self, avatar, channel):
+        self.avatar = avatar
+        self.channel = channel
         self.windowSize = (0, 0, 0, 0)
-        self.channelLookup.update({b'session': session.SSHSession})
 
     def openShell(self, protocol):
-        serverProtocol = insults.ServerProtocol(OPSSHShell, self, self.commands)
+        serverProtocol = insults.ServerProtocol(OPSSHShell, self, self.avatar.commands)
         serverProtocol.makeConnection(protocol)
         protocol.makeConnection(session.wrapProtocol(serverProtocol))
 
@@ -158,26 +318,89 @@ class OPSSHAvatar(avatar.ConchUser):
 
     def windowChanged(self, windowSize):
         self.windowSize = windowSize
+        if self.channel.recording:
+            self.channel.recording.resize(windowSize[0], windowSize[1])
 
     def execCommand(self, protocol, cmd):
-        raise NotImplementedError()
+        try:
+            args = shlex.split(cmd.decode())
+        except ValueError:
+            args = []
+
+        if not args or args[0] not in self.avatar.exec_commands:
+            protocol.session.writeExtended(connection.EXTENDED_DATA_STDERR, b"No such command.\n")
+            protocol.session.conn.sendRequest(protocol.session, b'exit-status', struct.pack('>L', 127))
+            protocol.session.loseConnection()
+            return
+
+        execProtocol = self.avatar.exec_commands[args[0]](self.avatar, args)
+        execProtocol.makeConnection(protocol)
+        protocol.makeConnection(session.wrapProtocol(execProtocol))
+
+    def eofReceived(self):
+        pass
 
     def closed(self):
         pass
 
 
+class OPSSHSessionChannel(session.SSHSession):
+    def __init__(self, *args, **kw):
+        session.SSHSession.__init__(self, *args, **kw)
+        self.session = OPSSHSession(self.avatar, self)
+        self.entry = None
+        self.producer = None
+        self.recording = None
+
+    def dataReceived(self, data):
+        if self.recording:
+            self.recording.input(data)
+        session.SSHSession.dataReceived(self, data)
+
+    def write(self, data):
+        if self.entry:
+            self.entry.bytes_sent += len(data)
+        if self.recording:
+            self.recording.output(data)
+        session.SSHSession.write(self, data)
+
+    def closed(self):
+        if self.recording:
+            self.recording.close()
+            self.recording = None
+        session.SSHSession.closed(self)
+
+    def stopWriting(self):
+        if self.producer:
+            self.producer.pauseProducing()
+
+    def startWriting(self):
+        if self.producer:
+            self.producer.resumeProducing()
+
+
 class OPSSHShell(recvline.HistoricRecvLine):
-    def __init__(self, avatar, commands):
-        self._OctoPrintSSH = avatar.conn.transport._OctoPrintSSH
-        self.avatar = avatar
-        self.user = self._OctoPrintSSH._user_manager.find_user(avatar.username.decode())
-        self.username = avatar.username
+    def __init__(self, session, commands):
+        self._OctoPrintSSH = session.avatar.conn.transport._OctoPrintSSH
+        self.avatar = session.avatar
+        self.ssh_session = session
+        self.username = session.avatar.username
         self.pwd = '/'
         self.ps = '$'
         self.commands = {}
         for command in commands:
             self.commands[command._name_] = command
+        self.command_names = sorted(self.commands)
         self.running_command = None
+        self.session = None
+
+    @property
+    def user(self):
+        return self.avatar.user
+
+    @property
+    def windowSize(self):
+        return self.ssh_session.windowSize
 
     def handle_CTRL_C(self):
         if self.running_command:
@@ -207,7 +430,7 @@ class OPSSHShell(recvline.HistoricRecvLine):
         else:
             self.terminal.reset()
             self.showPrompt()
-            self.terminal.write(''.join(self.lineBuffer))
+            self.terminal.write(b''.join(self.lineBuffer))
 
     def handle_CTRL_U(self):
         if self.running_command:
@@ -223,7 +446,72 @@ class OPSSHShell(recvline.HistoricRecvLine):
             self.terminal.cursorPosition(self.terminal.cursorPos.x, self.terminal.cursorPos.y)
             self.showPrompt()
 
+    def handle_TAB(self):
+        if self.running_command:
+            try:
+                self.running_command.handle_TAB()
+            except NotImplementedError:
+                pass
+            return
+
+        line = b''.join(self.lineBuffer[:self.lineBufferIndex]).decode()
+        segment = line.rsplit('|', 1)[-1].lstrip()
+        word = segment.rsplit(' ', 1)[-1]
+
+        if ' ' not in segment:
+            candidates = [(name, False) for name in complete(self.command_names, word)]
+            prefix = word
+        else:
+            if '/' in word:
+                directory, prefix = word.rsplit('/', 1)
+                directory = directory or '/'
+            else:
+                directory, prefix = '', word
+
+            if not directory.startswith('/'):
+                directory = os.path.join(self.pwd, directory)
+
+            candidates = self._OctoPrintSSH.path_index.children(directory, prefix)
+
+        if not candidates:
+            return
+
+        if len(candidates) == 1:
+            name, is_dir = candidates[0]
+            self.insertText(name[len(prefix):] + ('/' if is_dir else ' '))
+            return
+
+        common = os.path.commonprefix([name for name, is_dir in candidates])
+        if len(common) > len(prefix):
+            self.insertText(common[len(prefix):])
+            return
+
+        self.terminal.nextLine()
+        self.terminal.write('  '.join(name + ('/' if is_dir else '') for name, is_dir in candidates))
+        self.terminal.nextLine()
+        self.showPrompt()
+        self.terminal.write(b''.join(self.lineBuffer))
+        if self.lineBufferIndex < len(self.lineBuffer):
+            self.terminal.cursorBackward(len(self.lineBuffer) - self.lineBufferIndex)
+
+    def handle_RETURN(self):
+        line = b''.join(self.lineBuffer)
+        if line:
+            self._OctoPrintSSH.history.append(self.username.decode(), line)
+        recvline.HistoricRecvLine.handle_RETURN(self)
+
+    def insertText(self, text):
+        text = text.encode()
+        for i in range(len(text)):
+            recvline.HistoricRecvLine.characterReceived(self, text[i:i + 1], False)
+
     def connectionMade(self):
+        # Registered first so the recording includes the welcome screen.
+        self.session = self._OctoPrintSSH.sessions.register(self)
+        self.ssh_session.channel.entry = self.session
+        if self._OctoPrintSSH.recorder.enabled:
+            self.ssh_session.channel.recording = self._OctoPrintSSH.recorder.open(self.session, self.windowSize)
+
         recvline.HistoricRecvLine.connectionMade(self)
 
         self.keyHandlers.update({
@@ -231,9 +519,22 @@ class OPSSHShell(recvline.HistoricRecvLine):
             b'\x04': self.handle_CTRL_D,
             b'\x0c': self.handle_CTRL_L,
             b'\x15': self.handle_CTRL_U,
+            b'\t': self.handle_TAB,
         })
 
+        self._OctoPrintSSH.history.load(self.username.decode()).addCallback(self._historyLoaded)
+
+    def _historyLoaded(self, lines):
+        self.historyLines = lines
+        self.historyPosition = len(lines)
+
     def connectionLost(self, reason):
+        if self.running_command:
+            self.killRunningCommand()
+
+        if self.session:
+            self._OctoPrintSSH.sessions.unregister(self.session)
+
         recvline.HistoricRecvLine.connectionLost(self, reason)
 
     def initializeScreen(self):
@@ -256,14 +557,27 @@ class OPSSHShell(recvline.HistoricRecvLine):
             except NotImplementedError:
                 pass
 
-        args = shlex.split(line)
-        if len(args):
-            self.runCommand(args[0], *args)
+        try:
+            stages = split_pipeline(line)
+        except ValueError as e:
+            self.terminal.write("syntax error: {}".format(e))
+            self.terminal.nextLine()
+            self.showPrompt()
+            return
+
+        if len(stages) > 1:
+            self.session.command = line
+            self.runPipeline(stages)
+        elif len(stages[0]):
+            self.runCommand(stages[0][0], *stages[0])
 
         if not self.running_command:
             self.showPrompt()
 
     def keystrokeReceived(self, keyID, modifier):
+        if self.session:
+            self.session.touch()
+
         if self.running_command:
             try:
                 self.running_command.keystrokeReceived(keyID, modifier)
@@ -284,13 +598,18 @@ class OPSSHShell(recvline.HistoricRecvLine):
         super(OPSSHShell, self).characterReceived(ch, moreCharactersComing)
 
     def runCommand(self, command, *args):
-        if command in self.commands:
+        if command in self.commands and self.commands[command]._pipeable_:
+            self.session.command = ' '.join(args)
+            self.runPipeline([args])
+        elif command in self.commands:
             try:
                 c = self.commands[command](self)
+                self.session.command = ' '.join(args)
                 r = c.main(*args)
                 if r:
                     self.running_command = r
                     return
+                self.session.command = None
             except Exception as e:
                 raise(e)
                 self._OctoPrintSSH._logger.error("Exception while running command `{command}`.\n{e}".format(command=args[0], e=e))
@@ -300,6 +619,45 @@ class OPSSHShell(recvline.HistoricRecvLine):
             self.terminal.write("No such command.")
             self.terminal.nextLine()
 
+    def runPipeline(self, stages):
+        commands = []
+        for args in stages:
+            if not len(args):
+                self.terminal.write("syntax error near unexpected token `|'")
+                self.terminal.nextLine()
+                self.session.command = None
+                return
+
+            if args[0] not in self.commands:
+                self.terminal.write("{}: No such command.".format(args[0]))
+                self.terminal.nextLine()
+                self.session.command = None
+                return
+
+            if len(stages) > 1 and not self.commands[args[0]]._pipeable_:
+                self.terminal.write("{}: cannot be used in a pipeline".format(args[0]))
+                self.terminal.nextLine()
+                self.session.command = None
+                return
+
+            commands.append((self.commands[args[0]](self), args))
+
+        self.running_command = OPSSHPipeline(self, commands)
+        self.running_command.start()
+
+    def commandFinished(self, command):
+        if self.running_command is command:
+            self.running_command = None
+            self.session.command = None
+            self.showPrompt()
+
+    def outputPending(self):
+        return len(self.ssh_session.channel.buf or b'')
+
     def killRunningCommand(self):
-        self.running_command.term()
+        try:
+            self.running_command.term()
+        except NotImplementedError:
+            pass
         self.running_command = None
+        self.session.command = None
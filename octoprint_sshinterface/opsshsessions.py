@@ -0,0 +1,192 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import math
+import time
+from twisted.internet import task
+
+
+class OPSSHTimerWheel(object):
+    def __init__(self, resolution=1.0, slots=64):
+        self.resolution = resolution
+        self.slots = [set() for _ in range(slots)]
+        self.tick = 0
+        self._due = {}
+
+    def schedule(self, item, delay):
+        self.cancel(item)
+        due = self.tick + max(1, int(math.ceil(delay / self.resolution)))
+        self.slots[due % len(self.slots)].add(item)
+        self._due[item] = due
+
+    def cancel(self, item):
+        due = self._due.pop(item, None)
+        if due is not None:
+            self.slots[due % len(self.slots)].discard(item)
+
+    def advance(self):
+        self.tick += 1
+        slot = self.slots[self.tick % len(self.slots)]
+        expired = [item for item in slot if self._due[item] <= self.tick]
+        for item in expired:
+            slot.discard(item)
+            del self._due[item]
+        return expired
+
+
+class OPSSHSessionEntry(object):
+    def __init__(self, id, shell):
+        self.shell = shell
+        self._start(id, shell.avatar)
+
+    def _start(self, id, avatar):
+        self.id = id
+        self.avatar = avatar
+        self.user = avatar.name
+        peer = avatar.conn.transport.transport.getPeer()
+        self.peer = "{}:{}".format(peer.host, peer.port)
+        self.started = time.time()
+        self.last_activity = self.started
+        self.command = None
+        self.bytes_sent = 0
+
+    @property
+    def transport(self):
+        return self.avatar.conn.transport
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def close(self, message=None):
+        if message:
+            self.shell.terminal.nextLine()
+            self.shell.terminal.write(message)
+            self.shell.terminal.nextLine()
+        self.shell.terminal.loseConnection()
+
+
+class OPSSHForwardEntry(OPSSHSessionEntry):
+    # A direct-tcpip channel, traffic in either direction counts as activity.
+    def __init__(self, id, channel):
+        self.channel = channel
+        self._start(id, channel.avatar)
+        self.command = "forward {}:{}".format(channel.host, channel.port)
+
+    def close(self, message=None):
+        self.channel.loseConnection()
+
+
+class OPSSHSessionManager(object):
+    def __init__(self, plugin):
+        self._OctoPrintSSH = plugin
+        self.sessions = {}
+        self.wheel = OPSSHTimerWheel()
+        self._next_id = 1
+        self._keepalive_missed = {}
+        self._loop = None
+
+    def start(self):
+        self._loop = task.LoopingCall(self._tick)
+        self._loop.start(self.wheel.resolution, now=False)
+
+    def stop(self):
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def register(self, shell):
+        return self._add(OPSSHSessionEntry(self._next_id, shell))
+
+    def register_forward(self, channel):
+        return self._add(OPSSHForwardEntry(self._next_id, channel))
+
+    def _add(self, entry):
+        self._next_id += 1
+        self.sessions[entry.id] = entry
+        self._schedule(entry)
+        return entry
+
+    def unregister(self, entry):
+        self.sessions.pop(entry.id, None)
+        self.wheel.cancel(entry)
+
+    def kill(self, id, message="Session terminated."):
+        entry = self.sessions.get(id)
+        if entry is None:
+            return False
+        self.unregister(entry)
+        entry.close(message)
+        return True
+
+    def _timeouts(self):
+        settings = self._OctoPrintSSH._settings
+        return settings.get_int(["session_idle_timeout"]), settings.get_int(["session_max_time"])
+
+    def _schedule(self, entry):
+        idle_timeout, max_time = self._timeouts()
+        now = time.time()
+        deadlines = []
+        if idle_timeout:
+            deadlines.append(entry.last_activity + idle_timeout)
+        if max_time:
+            deadlines.append(entry.started + max_time)
+        if deadlines:
+            self.wheel.schedule(entry, min(deadlines) - now)
+
+    def _expire(self, entry):
+        if entry.id not in self.sessions:
+            return
+
+        idle_timeout, max_time = self._timeouts()
+        now = time.time()
+        if max_time and now - entry.started >= max_time:
+            self._OctoPrintSSH._logger.info("Session {} for {} from {} reached the maximum session time".format(entry.id, entry.user, entry.peer))
+            self.kill(entry.id, "Maximum session time reached.")
+        elif idle_timeout and now - entry.last_activity >= idle_timeout:
+            self._OctoPrintSSH._logger.info("Session {} for {} from {} timed out".format(entry.id, entry.user, entry.peer))
+            self.kill(entry.id, "Timed out waiting for input.")
+        else:
+            self._schedule(entry)
+
+    def _tick(self):
+        for entry in self.wheel.advance():
+            try:
+                self._expire(entry)
+            except Exception:
+                self._OctoPrintSSH._logger.exception("Error while expiring session {}".format(entry.id))
+
+        interval = self._OctoPrintSSH._settings.get_int(["keepalive_interval"])
+        if interval and self.wheel.tick % max(1, int(interval / self.wheel.resolution)) == 0:
+            self._send_keepalives()
+
+    def _send_keepalives(self):
+        # Probed per authenticated connection, so one without any shell (ssh -N) is covered too.
+        max_count = self._OctoPrintSSH._settings.get_int(["keepalive_max_count"])
+        factory = self._OctoPrintSSH._ssh_factory
+        transports = factory.connections - factory.unauthenticated if factory else set()
+
+        for transport in list(self._keepalive_missed.keys()):
+            if transport not in transports:
+                del self._keepalive_missed[transport]
+
+        for transport in transports:
+            missed = self._keepalive_missed.get(transport, 0)
+            if max_count and missed >= max_count:
+                peer = transport.transport.getPeer()
+                self._OctoPrintSSH._logger.info("Keepalive timeout for {} port {}".format(peer.host, peer.port))
+                del self._keepalive_missed[transport]
+                transport.transport.loseConnection()
+                continue
+
+            self._keepalive_missed[transport] = missed + 1
+            d = transport.avatar.conn.sendGlobalRequest(b"keepalive@openssh.com", b"", wantReply=1)
+            d.addBoth(self._keepalive_answered, transport)
+
+    def _keepalive_answered(self, result, transport):
+        # Any reply, including a failure for the unknown request, proves the peer is alive.
+        if transport in self._keepalive_missed:
+            self._keepalive_missed[transport] = 0
@@ -0,0 +1,93 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import json
+import threading
+
+STATUS_KEYS = ('state', 'job', 'progress', 'currentZ', 'offsets', 'resends')
+
+
+def status_lines(data):
+    progress = data['progress']
+    file = data['job']['file']
+
+    return ["State: {}".format(data['state']['text']),
+            "File: {}".format(file['name']),
+            "Print Time: {}".format(progress['printTime'] or '-'),
+            "Print Time Left: {}".format(progress['printTimeLeft'] or '-'),
+            "Printed: {} / {}".format(progress['filepos'] or '-', file['size'] or '-')]
+
+
+def render_status(data, format, width=0):
+    if format == 'json':
+        status = dict((key, data[key]) for key in STATUS_KEYS if key in data)
+        return (json.dumps(status, default=str, sort_keys=True) + '\r\n').encode('utf-8')
+
+    lines = status_lines(data)
+    if width:
+        lines = [line[:width] for line in lines]
+    return ('\x1b[H\x1b[2J' + '\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+class OPSSHStatusSubscription(object):
+    # width is called on every broadcast, so a resized window is picked up.
+    def __init__(self, format, width, write):
+        self.format = format
+        self.width = width
+        self.write = write
+
+    @property
+    def key(self):
+        return (self.format, self.width() if self.format == 'text' else 0)
+
+
+class OPSSHStatusBroadcast(object):
+    # Every printer update is rendered once per distinct (format, width) and the
+    # same bytes are handed to all subscribers.
+    def __init__(self, call_from_thread):
+        self.call_from_thread = call_from_thread
+        self.renders = 0
+        self._subscriptions = set()
+        self._latest = None
+        self._scheduled = False
+        self._mutex = threading.Lock()
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def subscribe(self, format, width, write):
+        subscription = OPSSHStatusSubscription(format, width, write)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def update(self, data):
+        with self._mutex:
+            self._latest = data
+            if self._scheduled or not self._subscriptions:
+                return
+            self._scheduled = True
+
+        # Only the newest state matters, updates arriving before the reactor gets to it are folded.
+        self.call_from_thread(self._broadcast)
+
+    def _broadcast(self):
+        with self._mutex:
+            data = self._latest
+            self._scheduled = False
+
+        frames = {}
+        for subscription in list(self._subscriptions):
+            key = subscription.key
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = render_status(data, *key)
+                self.renders += 1
+            subscription.write(frame)
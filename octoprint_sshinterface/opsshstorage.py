@@ -0,0 +1,117 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import os
+import collections
+import threading
+from urllib.parse import quote
+from twisted.internet import defer, task, threads
+
+
+def atomic_write(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class OPSSHHistoryStore(object):
+    flush_interval = 5
+
+    def __init__(self, plugin, path):
+        self._OctoPrintSSH = plugin
+        self.path = path
+        self._histories = {}
+        self._loaded = set()
+        self._dirty = set()
+        self._mutex = threading.Lock()
+        self._loop = None
+        self._flushing = None
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @property
+    def size(self):
+        return max(0, self._OctoPrintSSH._settings.get_int(["history_size"]))
+
+    def start(self):
+        self._loop = task.LoopingCall(self._flush_later)
+        self._loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        # Returns a Deferred that fires once the flush in flight and a final one are done.
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+        if self._flushing is None:
+            d = defer.succeed(None)
+        else:
+            d = defer.Deferred()
+            self._flushing.addBoth(lambda result: d.callback(None))
+        d.addCallback(lambda result: threads.deferToThread(self.flush))
+        return d
+
+    def _file(self, username):
+        return os.path.join(self.path, quote(username, safe=''))
+
+    def load(self, username):
+        with self._mutex:
+            if username in self._loaded:
+                return defer.succeed(list(self._histories[username]))
+        return threads.deferToThread(self._load, username)
+
+    def _load(self, username):
+        lines = []
+        try:
+            with open(self._file(username), 'rb') as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            pass
+
+        with self._mutex:
+            if username not in self._loaded:
+                pending = self._histories.get(username, ())
+                self._histories[username] = collections.deque(lines, maxlen=self.size)
+                self._histories[username].extend(pending)
+                self._loaded.add(username)
+            return list(self._histories[username])
+
+    def append(self, username, line):
+        with self._mutex:
+            history = self._histories.get(username)
+            if history is None:
+                history = self._histories[username] = collections.deque(maxlen=self.size)
+            if not len(history) or history[-1] != line:
+                history.append(line)
+                self._dirty.add(username)
+
+    def _flush_later(self):
+        if self._flushing is not None or not self._dirty:
+            return
+
+        self._flushing = threads.deferToThread(self.flush)
+        self._flushing.addBoth(self._flushed)
+
+    def _flushed(self, result):
+        self._flushing = None
+
+    def flush(self):
+        with self._mutex:
+            pending = dict((username, list(self._histories[username])) for username in self._dirty if username in self._loaded)
+            self._dirty.difference_update(pending)
+
+        for username, lines in pending.items():
+            try:
+                atomic_write(self._file(username), b''.join(line + b'\n' for line in lines))
+            except (IOError, OSError) as e:
+                self._OctoPrintSSH._logger.error("Unable to save command history for {}: {}".format(username, e))
+                with self._mutex:
+                    self._dirty.add(username)
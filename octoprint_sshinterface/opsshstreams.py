@@ -0,0 +1,255 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import fnmatch
+import json
+import struct
+import threading
+import time
+from octoprint.access.permissions import Permissions
+from octoprint.events import Events
+from twisted.conch.ssh.connection import EXTENDED_DATA_STDERR
+from twisted.internet import protocol, reactor
+
+
+class OPSSHLineBuffer(object):
+    def __init__(self, write, backlog=10000):
+        self.write = write
+        self.backlog = backlog
+        self._lines = collections.deque()
+        self._dropped = 0
+        self._paused = False
+        self._flush_call = None
+        self.closed = False
+
+    def append(self, line):
+        if self.closed:
+            return
+
+        if len(self._lines) >= self.backlog:
+            self._lines.popleft()
+            self._dropped += 1
+        self._lines.append(line)
+
+        if not self._paused and self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self._flush)
+
+    def _flush(self):
+        self._flush_call = None
+        if self.closed or self._paused or not self._lines:
+            return
+
+        lines = self._lines
+        self._lines = collections.deque()
+        if self._dropped:
+            lines.appendleft("!! dropped {} lines".format(self._dropped))
+            self._dropped = 0
+
+        self.write(lines)
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        if not self.closed and self._lines and self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self._flush)
+
+    def stopProducing(self):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self._lines.clear()
+
+
+# Permissions needed on top of STATUS to receive an event. Events naming files need FILES_LIST,
+# events naming users or client addresses are only sent to administrators.
+EVENT_PERMISSIONS = dict(
+    [(event, (Permissions.FILES_LIST,)) for event in (
+        Events.UPLOAD, Events.FILE_ADDED, Events.FILE_REMOVED, Events.FILE_MOVED,
+        Events.FOLDER_ADDED, Events.FOLDER_REMOVED, Events.FOLDER_MOVED, Events.UPDATED_FILES,
+        Events.METADATA_ANALYSIS_STARTED, Events.METADATA_ANALYSIS_FINISHED, Events.METADATA_STATISTICS_UPDATED,
+        Events.TRANSFER_STARTED, Events.TRANSFER_DONE, Events.TRANSFER_FAILED,
+        Events.SLICING_STARTED, Events.SLICING_DONE, Events.SLICING_CANCELLED, Events.SLICING_FAILED)] +
+    [(event, (Permissions.ADMIN,)) for event in (
+        Events.USER_LOGGED_IN, Events.USER_LOGGED_OUT,
+        Events.CLIENT_OPENED, Events.CLIENT_AUTHED, Events.CLIENT_DEAUTHED, Events.CLIENT_CLOSED)])
+
+
+class OPSSHEventSubscription(object):
+    # permissions returns the subscriber's current permissions, checked for every event.
+    def __init__(self, patterns, callback, permissions):
+        self.patterns = patterns
+        self.callback = callback
+        self.permissions = permissions
+        self._matches = {}
+
+    def allowed(self, event):
+        required = EVENT_PERMISSIONS.get(event)
+        if not required:
+            return True
+        permissions = self.permissions()
+        return all(p in permissions for p in required)
+
+    def matches(self, event):
+        try:
+            return self._matches[event]
+        except KeyError:
+            result = not self.patterns or any(fnmatch.fnmatchcase(event, p) for p in self.patterns)
+            self._matches[event] = result
+            return result
+
+
+class OPSSHEventHub(object):
+    def __init__(self, call_from_thread):
+        self.call_from_thread = call_from_thread
+        self._subscriptions = set()
+        self._mutex = threading.Lock()
+
+    def subscribe(self, patterns, callback, permissions):
+        subscription = OPSSHEventSubscription(patterns, callback, permissions)
+        with self._mutex:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._mutex:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, payload):
+        if not self._subscriptions:
+            return
+
+        with self._mutex:
+            targets = [s for s in self._subscriptions if s.matches(event) and s.allowed(event)]
+        if not targets:
+            return
+
+        # Serialized once no matter how many sessions are subscribed.
+        line = json.dumps(dict(event=event, time=time.time(), payload=payload), default=str)
+        self.call_from_thread(self._deliver, targets, line)
+
+    def _deliver(self, targets, line):
+        # Subscriptions may have ended while the event was queued for the reactor.
+        for subscription in targets:
+            if subscription in self._subscriptions:
+                subscription.callback(line)
+
+
+class OPSSHExecCommand(protocol.Protocol):
+    _name_ = "commandname"
+    _description_ = ""
+
+    def __init__(self, avatar, args):
+        self.avatar = avatar
+        self.args = args
+        self._OctoPrintSSH = avatar.conn.transport._OctoPrintSSH
+
+    @property
+    def user(self):
+        return self.avatar.user
+
+    @property
+    def channel(self):
+        return self.transport.session
+
+    def exit(self, status, message=None):
+        if message:
+            self.channel.writeExtended(EXTENDED_DATA_STDERR, (message + '\n').encode())
+        self.channel.conn.sendRequest(self.channel, b'exit-status', struct.pack('>L', status))
+        self.transport.loseConnection()
+available_exec_commands = []
+
+
+class OPSSHExecCommand_serial_stream(OPSSHExecCommand):
+    _name_ = "serial-stream"
+    _description_ = """
+    serial-stream
+
+    Streams the raw printer communication log as newline delimited lines and
+    sends every line received on stdin to the printer. When the client does not
+    keep up, the oldest lines are dropped and a "!! dropped N lines" line is
+    inserted.
+    """
+
+    def __init__(self, avatar, args):
+        OPSSHExecCommand.__init__(self, avatar, args)
+        self.buffer = OPSSHLineBuffer(self._write)
+        self._input = b''
+
+    def connectionMade(self):
+        if not Permissions.MONITOR_TERMINAL in self.user.effective_permissions:
+            self.exit(1, "Access denied.")
+            return
+
+        self.channel.producer = self.buffer
+        with self._OctoPrintSSH._terminal_cbs_mutex:
+            self._OctoPrintSSH._terminal_cbs[('serial-stream', id(self))] = self.buffer.append
+
+    def connectionLost(self, reason):
+        with self._OctoPrintSSH._terminal_cbs_mutex:
+            self._OctoPrintSSH._terminal_cbs.pop(('serial-stream', id(self)), None)
+        self.buffer.close()
+
+    def _write(self, lines):
+        self.transport.write(('\n'.join(lines) + '\n').encode('utf-8', 'replace'))
+
+    def dataReceived(self, data):
+        data = self._input + data
+        end = data.rfind(b'\n') + 1
+        self._input = data[end:]
+
+        commands = [l.strip() for l in data[:end].decode('utf-8', 'replace').splitlines() if l.strip()]
+        if not commands:
+            return
+
+        if not Permissions.CONTROL in self.user.effective_permissions:
+            self.channel.writeExtended(EXTENDED_DATA_STDERR, b"Access denied.\n")
+            return
+
+        self._OctoPrintSSH._printer.commands(commands)
+available_exec_commands.append(OPSSHExecCommand_serial_stream)
+
+
+class OPSSHExecCommand_events(OPSSHExecCommand):
+    _name_ = "events"
+    _description_ = """
+    events [EVENT...]
+
+    Streams OctoPrint events as JSON lines. EVENT may contain shell style
+    wildcards. All events are streamed when none are given. File events need
+    the file list permission, user and client events are only streamed to
+    administrators.
+    """
+
+    def __init__(self, avatar, args):
+        OPSSHExecCommand.__init__(self, avatar, args)
+        self.buffer = OPSSHLineBuffer(self._write)
+        self.subscription = None
+
+    def connectionMade(self):
+        if not Permissions.STATUS in self.user.effective_permissions:
+            self.exit(1, "Access denied.")
+            return
+
+        self.channel.producer = self.buffer
+        self.subscription = self._OctoPrintSSH.event_hub.subscribe(self.args[1::], self.buffer.append, lambda: self.user.effective_permissions)
+
+    def connectionLost(self, reason):
+        if self.subscription:
+            self._OctoPrintSSH.event_hub.unsubscribe(self.subscription)
+            self.subscription = None
+        self.buffer.close()
+
+    def _write(self, lines):
+        self.transport.write(('\n'.join(lines) + '\n').encode('utf-8'))
+available_exec_commands.append(OPSSHExecCommand_events)
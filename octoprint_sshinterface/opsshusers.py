@@ -0,0 +1,99 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2020 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import threading
+from octoprint.access.groups import GroupChangeListener
+from octoprint.access.users import LoginStatusListener
+from twisted.internet import task
+
+OPSSHUserSnapshot = collections.namedtuple('OPSSHUserSnapshot', ['name', 'is_active', 'effective_permissions'])
+
+
+class OPSSHUserDirectory(LoginStatusListener, GroupChangeListener):
+    # OctoPrint only signals user changes for users with a web session, so snapshots
+    # are also revalidated in the background to catch changes to SSH only users.
+    revalidate_interval = 10
+
+    def __init__(self, plugin, on_change=None):
+        self._OctoPrintSSH = plugin
+        self.on_change = on_change
+        self._snapshots = {}
+        self._mutex = threading.Lock()
+        self._loop = None
+
+    def start(self):
+        self._OctoPrintSSH._user_manager.register_login_status_listener(self)
+        self._OctoPrintSSH._group_manager.register_listener(self)
+        self._loop = task.LoopingCall(self.refresh)
+        self._loop.start(self.revalidate_interval, now=False)
+
+    def stop(self):
+        try:
+            self._OctoPrintSSH._user_manager.unregister_login_status_listener(self)
+            self._OctoPrintSSH._group_manager.unregister_listener(self)
+        except ValueError:
+            pass
+
+        if self._loop and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def get(self, username, fresh=False):
+        if not fresh:
+            try:
+                return self._snapshots[username]
+            except KeyError:
+                pass
+        return self._update(username)
+
+    def _update(self, username):
+        user = self._OctoPrintSSH._user_manager.find_user(username)
+        with self._mutex:
+            if user is None:
+                # A removed user stays cached as inactive so sessions still open do not query the
+                # user manager on every lookup. Names that never existed are not cached.
+                snapshot = OPSSHUserSnapshot(username, False, frozenset())
+                previous = self._snapshots.get(username)
+                if previous is not None:
+                    self._snapshots[username] = snapshot
+            else:
+                snapshot = OPSSHUserSnapshot(username, bool(user.is_active), frozenset(user.effective_permissions))
+                previous = self._snapshots.get(username)
+                self._snapshots[username] = snapshot
+
+        if previous is not None and previous != snapshot and self.on_change:
+            self.on_change(previous, snapshot)
+        return snapshot
+
+    def refresh(self, username=None):
+        with self._mutex:
+            if username is None:
+                usernames = list(self._snapshots)
+            else:
+                usernames = [username] if username in self._snapshots else []
+
+        for name in usernames:
+            try:
+                self._update(name)
+            except Exception:
+                self._OctoPrintSSH._logger.exception("Error while refreshing permissions of {}".format(name))
+
+    def on_user_modified(self, user):
+        self.refresh(user.get_id())
+
+    def on_user_removed(self, userid):
+        self.refresh(userid)
+
+    def on_group_removed(self, group):
+        self.refresh()
+
+    def on_group_permissions_changed(self, group, added=None, removed=None):
+        self.refresh()
+
+    def on_group_subgroups_changed(self, group, added=None, removed=None):
+        self.refresh()
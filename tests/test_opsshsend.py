@@ -0,0 +1,46 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import unittest
+
+from octoprint_sshinterface.opsshsend import OPSSHAckMatcher
+
+
+class OPSSHAckMatcherTest(unittest.TestCase):
+    def test_host_handled_commands_settle_when_queued(self):
+        acks = OPSSHAckMatcher(["M0", "M1"])
+        self.assertEqual(acks.queue(["G1 X1", "@pause", "M0", "G1 X2"]), 2)
+
+        self.assertEqual(acks.feed("Send: N10 G1 X1*33"), 0)
+        self.assertEqual(acks.feed("Recv: ok"), 1)
+        self.assertEqual(acks.feed("Send: N11 G1 X2*34"), 0)
+        self.assertEqual(acks.feed("Recv: ok"), 1)
+
+    def test_foreign_commands_are_not_counted(self):
+        acks = OPSSHAckMatcher()
+        acks.queue(["G28"])
+
+        self.assertEqual(acks.feed("Send: M105"), 0)
+        self.assertEqual(acks.feed("Send: G28"), 0)
+        self.assertEqual(acks.feed("Recv: ok T:20.0 /0.0"), 0)
+        self.assertEqual(acks.feed("Recv: ok"), 1)
+
+    def test_dropped_commands_settle_once_a_later_one_is_sent(self):
+        acks = OPSSHAckMatcher()
+        acks.queue(["M117 dropped by a hook", "M300", "G1 X1"])
+
+        self.assertEqual(acks.feed("Send: G1 X1"), 2)
+        self.assertEqual(acks.feed("Recv: ok"), 1)
+
+    def test_polled_commands_do_not_skip_ahead(self):
+        acks = OPSSHAckMatcher()
+        acks.queue(["G28", "M105"])
+
+        self.assertEqual(acks.feed("Send: M105"), 0)
+        self.assertEqual(acks.feed("Recv: ok"), 0)
+        self.assertEqual(acks.feed("Send: G28"), 0)
+        self.assertEqual(acks.feed("Recv: ok"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()